@@ -3,25 +3,50 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import Config
 
-db = SQLAlchemy()
+from app import routing
+
+# Routes read-only statements to replicas when DATABASE_REPLICA_URLS is set
+db = SQLAlchemy(session_options={'class_': routing.RoutingSession})
 login_manager = LoginManager()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    routing.configure(app)
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'main.login'
     login_manager.login_message = 'Please log in to access this page.'
     
-    from app.models import User
+    routing.init_app(app)
+    
+    from app import instrumentation
+    instrumentation.init_app(app)
+    
+    from app import user_cache
+    user_cache.init_app(app)
+    
+    from app import fragments
+    fragments.init_app(app)
+    
+    from app import live
+    live.init_app(app)
+    
+    from app import audit
+    audit.init_app(app)
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.load_principal(int(user_id))
     
     from app.routes import main
     app.register_blueprint(main)
     
+    from app.api import api
+    app.register_blueprint(api)
+    
+    from app.cli import register_commands
+    register_commands(app)
+    
     return app 
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""Versioned JSON API for scripts and mobile clients.
+
+Requests authenticate with ``Authorization: Bearer <token>`` (tokens are
+created with ``flask create-api-token``). A token belongs to one household
+and sees only that group's expenses and balances. Reads select plain column tuples and
+serialize them directly, without building ORM objects, and every ``GET``
+answers ``If-None-Match`` with ``304 Not Modified`` while the data version is
+unchanged - a client polling balances usually costs two indexed lookups.
+"""
+import hashlib
+import secrets
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, jsonify, request, url_for
+from sqlalchemy import select, tuple_
+from werkzeug.exceptions import HTTPException
+
+from app import db, services, user_cache
+from app.balances import compute_balances
+from app.filters import expense_criteria
+from app.fragments import current_data_version, set_validators
+from app.groups import current_group_id
+from app.importer import parse_row, insert_batch
+from app.instrumentation import query_budget
+from app.models import User, Expense, ApiToken, expense_json
+from app.pagination import encode_cursor, decode_cursor
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Largest page a client may ask for with ?limit=
+MAX_PAGE_SIZE = 500
+# Most expenses accepted by one batch create
+MAX_BATCH_SIZE = 1000
+
+# Named after EXPENSE_JSON_FIELDS, for expense_json
+_EXPENSE_COLUMNS = (Expense.id, Expense.group_id, Expense.date_entered, Expense.amount_eur,
+                    Expense.note, Expense.status, Expense.user_id,
+                    User.full_name.label('user_name'), Expense.version)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.extra = extra
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token(user_id, group_id, name):
+    """Create an API token for one group; returns ``(ApiToken, token)``.
+    The caller commits.
+
+    The plain token is only available here; it cannot be recovered later.
+    """
+    token = secrets.token_urlsafe(32)
+    api_token = ApiToken(user_id=user_id, group_id=group_id, name=name,
+                         token_hash=hash_token(token))
+    db.session.add(api_token)
+    return api_token, token
+
+
+@api.before_request
+def _authenticate():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise ApiError(401, 'Missing bearer token')
+
+    # Revoked tokens must stop working at once, so never ask a replica
+    row = db.session.query(ApiToken.user_id, ApiToken.group_id).filter(
+        ApiToken.token_hash == hash_token(token.strip())
+    ).execution_options(use_primary=True).first()
+    g.api_user = user_cache.load_principal(row.user_id) if row else None
+    # A token stops working when its user leaves the group
+    if g.api_user is None or row.group_id not in g.api_user.group_ids:
+        raise ApiError(401, 'Invalid token')
+    g.api_group_id = row.group_id
+
+
+@api.errorhandler(ApiError)
+def _api_error(e):
+    response = jsonify(error=e.message, **e.extra)
+    response.status_code = e.status
+    if e.status == 401:
+        response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+@api.errorhandler(HTTPException)
+def _http_error(e):
+    response = jsonify(error=e.description)
+    response.status_code = e.code
+    return response
+
+
+def _json_body():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise ApiError(400, 'Request body must be a JSON object')
+    return payload
+
+
+def _expense_row(expense_id):
+    row = db.session.execute(
+        select(*_EXPENSE_COLUMNS).join(User, User.id == Expense.user_id)
+        .where(Expense.id == expense_id, Expense.group_id == current_group_id())
+    ).first()
+    if row is None:
+        raise ApiError(404, 'Expense not found')
+    return row
+
+
+def _parse_expense(payload):
+    """Validate ``amount_eur`` and ``note`` with the import rules"""
+    fields = {key: str(payload[key]) for key in ('amount_eur', 'note')
+              if payload.get(key) is not None}
+    return parse_row(fields, {}, g.api_user.id, datetime.utcnow())
+
+
+def _editable_expense(expense_id):
+    expense = db.session.get(Expense, expense_id)
+    if expense is None or expense.group_id != current_group_id():
+        raise ApiError(404, 'Expense not found')
+    if expense.user_id != g.api_user.id and not g.api_user.is_admin:
+        raise ApiError(403, 'You can only change your own expenses')
+    return expense
+
+
+def _expected_version(value):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, "'version' must be a whole number")
+
+
+def _conflict(expense_id):
+    """Answer 409 with the expense as it is now (None if it was deleted)"""
+    db.session.rollback()
+    try:
+        current = expense_json(_expense_row(expense_id)._mapping)
+    except ApiError:
+        current = None
+    raise ApiError(409, 'The expense was changed by someone else', current=current)
+
+
+def _conditional(build):
+    """Answer a GET from ``build()``, or 304 if the client's copy is current"""
+    etag = hashlib.sha1(repr((
+        request.endpoint, request.full_path, current_group_id(),
+        current_data_version(current_group_id()),
+        current_app.config['ETAG_SALT']
+    )).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = build()
+    return set_validators(response, etag)
+
+
+@api.route('/expenses')
+@query_budget(4)
+def list_expenses():
+    """Expenses newest first; follow ``next_cursor`` for older pages."""
+    try:
+        criteria = expense_criteria(current_group_id(), request.args)
+        cursor = request.args.get('cursor')
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    limit = min(max(request.args.get('limit', current_app.config['EXPENSES_PER_PAGE'], type=int), 1),
+                MAX_PAGE_SIZE)
+
+    def build():
+        stmt = select(*_EXPENSE_COLUMNS).join(
+            User, User.id == Expense.user_id
+        ).where(*criteria).order_by(Expense.date_entered.desc(), Expense.id.desc())
+        if position:
+            stmt = stmt.where(tuple_(Expense.date_entered, Expense.id) < position)
+        rows = db.session.execute(stmt.limit(limit + 1)).all()
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return jsonify(expenses=[expense_json(row._mapping) for row in rows[:limit]],
+                       next_cursor=next_cursor)
+
+    return _conditional(build)
+
+
+@api.route('/expenses/<int:expense_id>')
+@query_budget(4)
+def get_expense(expense_id):
+    return _conditional(lambda: jsonify(expense_json(_expense_row(expense_id)._mapping)))
+
+
+@api.route('/expenses', methods=['POST'])
+def create_expense():
+    try:
+        record = _parse_expense(_json_body())
+    except ValueError as e:
+        raise ApiError(422, str(e))
+    expense = services.add_expense(current_group_id(), g.api_user.id, record['amount_eur'],
+                                   record['note'])
+    db.session.flush()
+    expense_id = expense.id
+    db.session.commit()
+
+    response = jsonify(expense_json(_expense_row(expense_id)._mapping))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.get_expense', expense_id=expense_id)
+    return response
+
+
+@api.route('/expenses/batch', methods=['POST'])
+def create_expenses_batch():
+    """Create many expenses at once; nothing is created if any is invalid."""
+    items = _json_body().get('expenses')
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, "'expenses' must be a non-empty list")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ApiError(413, f'At most {MAX_BATCH_SIZE} expenses per batch')
+
+    records, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('must be a JSON object')
+            records.append(_parse_expense(item))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise ApiError(422, 'Invalid expenses; nothing was created', errors=errors)
+
+    insert_batch(current_group_id(), records)
+    db.session.commit()
+    return jsonify(created=len(records)), 201
+
+
+@api.route('/expenses/<int:expense_id>', methods=['PATCH'])
+def update_expense(expense_id):
+    """Include ``version`` to update only the version you have seen."""
+    expense = _editable_expense(expense_id)
+    payload = _json_body()
+    try:
+        record = _parse_expense({'amount_eur': payload.get('amount_eur', expense.amount_eur),
+                                 'note': payload.get('note', expense.note)})
+    except ValueError as e:
+        raise ApiError(422, str(e))
+    try:
+        services.update_expense(expense, record['amount_eur'], record['note'],
+                                expected_version=_expected_version(payload.get('version')))
+        db.session.commit()
+    except services.ExpenseConflict:
+        _conflict(expense_id)
+    return jsonify(expense_json(_expense_row(expense_id)._mapping))
+
+
+@api.route('/expenses/<int:expense_id>', methods=['DELETE'])
+def delete_expense(expense_id):
+    """Pass ``?version=`` to delete only the version you have seen."""
+    try:
+        services.delete_expense(_editable_expense(expense_id),
+                                expected_version=_expected_version(request.args.get('version')))
+        db.session.commit()
+    except services.ExpenseConflict:
+        _conflict(expense_id)
+    return '', 204
+
+
+@api.route('/balances')
+@query_budget(4)
+def balances():
+    """Current-period balances, as on the dashboard."""
+    def build():
+        summary = compute_balances(current_group_id())
+        return jsonify(
+            total_expenses=str(summary.total_expenses),
+            cost_per_person=str(summary.cost_per_person),
+            member_count=summary.member_count,
+            period_start=summary.period_start.isoformat() if summary.period_start else None,
+            members=[{
+                'user_id': member.user_id,
+                'name': member.name,
+                'total_paid': str(member.total_paid),
+                'expense_count': member.expense_count,
+                'balance': str(member.balance),
+            } for member in summary.members]
+        )
+
+    return _conditional(build)
@@ -0,0 +1,234 @@
+"""Append-only audit log of expense changes.
+
+Every expense mutation (:mod:`app.services`, the bulk importer) calls
+:func:`record` with the expense's fields before and after the change. Events
+wait on the session and are only logged once the transaction commits, as
+:class:`~app.models.ExpenseEvent` rows, according to ``AUDIT_LOG_MODE``:
+
+* ``async`` (default) - committed events go to an in-process queue and a
+  writer thread inserts them in batches of up to ``AUDIT_BATCH_SIZE``, at
+  least every ``AUDIT_FLUSH_SECONDS``. Requests don't wait for their log
+  rows; events still queued when a process is killed are lost.
+* ``sync`` - events are inserted by the committing transaction itself, so a
+  change and its history commit (or roll back) together.
+* ``off`` - nothing is logged; meant for loading synthetic data.
+
+:func:`expenses_as_of` and :func:`balances_as_of` replay one group's log
+backwards from its current state, so they need no snapshot; history from
+before the log was enabled is not known.
+"""
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from flask import current_app, g, has_app_context, has_request_context
+from flask_login import current_user
+from sqlalchemy import event, insert, inspect, select
+
+from app import db
+from app.balances import period_balances
+from app.models import Expense, ExpenseEvent, UserBalance, expense_json
+from app.routing import RoutingSession
+
+EXPENSE_FIELDS = ('date_entered', 'amount_eur', 'note', 'status', 'user_id')
+MODES = ('async', 'sync', 'off')
+
+
+def snapshot(expense):
+    """JSON-ready copy of an expense's fields, from an ``Expense`` or a dict"""
+    fields = ('group_id', *EXPENSE_FIELDS)
+    if isinstance(expense, Expense):
+        return expense.to_dict(fields)
+    return expense_json(expense, fields)
+
+
+def _actor_id():
+    if has_app_context() and 'audit_actor_id' in g:
+        return g.audit_actor_id
+    if has_request_context():
+        if g.get('api_user') is not None:
+            return g.api_user.id
+        if current_user.is_authenticated:
+            return current_user.id
+    return None
+
+
+def mode():
+    """The configured ``AUDIT_LOG_MODE``"""
+    return current_app.config['AUDIT_LOG_MODE']
+
+
+def record(action, expense, before=None, after=None):
+    """Log a change to ``expense`` (an ``Expense`` or its id) once committed.
+
+    ``before`` and ``after`` are :func:`snapshot` results; ``before`` is
+    None for a new expense, ``after`` None for a deleted one.
+    """
+    if mode() == 'off':
+        return
+    db.session.info.setdefault('audit_events', []).append(
+        (action, expense, before, after, _actor_id(), datetime.utcnow())
+    )
+
+
+def _rows(pending):
+    return [{
+        # New expenses only get their ids on flush, so resolve them late
+        'expense_id': expense if isinstance(expense, int) else inspect(expense).identity[0],
+        'group_id': (after or before)['group_id'],
+        'action': action, 'actor_id': actor_id, 'occurred_at': occurred_at,
+        'before': before, 'after': after,
+    } for action, expense, before, after, actor_id, occurred_at in pending]
+
+
+def _write_in_transaction(session):
+    if not session.info.get('audit_events') or mode() != 'sync':
+        return
+    session.flush()
+    session.execute(insert(ExpenseEvent), _rows(session.info.pop('audit_events')))
+
+
+def _hand_to_writer(session):
+    pending = session.info.pop('audit_events', None)
+    if pending:
+        current_app.extensions['audit_writer'].put(_rows(pending))
+
+
+def _discard(session):
+    session.info.pop('audit_events', None)
+
+
+class AuditWriter:
+    """Background thread that inserts committed events in batches"""
+
+    def __init__(self, app):
+        self.app = app
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, rows):
+        with self._lock:
+            if self._thread is None:
+                # Started lazily so it runs in the gunicorn worker, not the master
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        self._queue.put(rows)
+
+    def flush(self):
+        """Wait until every queued event has been written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_BATCH_SIZE']
+        interval = self.app.config['AUDIT_FLUSH_SECONDS']
+        while True:
+            rows = list(self._queue.get())
+            taken = 1
+            deadline = time.monotonic() + interval
+            while len(rows) < batch_size:
+                try:
+                    rows.extend(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                    taken += 1
+                except queue.Empty:
+                    break
+            self._write(rows, batch_size)
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def _write(self, rows, batch_size):
+        with self.app.app_context():
+            for attempt in range(3):
+                try:
+                    for start in range(0, len(rows), batch_size):
+                        db.session.execute(insert(ExpenseEvent), rows[start:start + batch_size])
+                    db.session.commit()
+                    return
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Writing %s audit event(s) failed (attempt %s)',
+                                              len(rows), attempt + 1)
+                    time.sleep(attempt + 1)
+            self.app.logger.error('Dropped %s audit event(s)', len(rows))
+
+
+def _events_after(group_id, when):
+    return db.session.execute(
+        select(ExpenseEvent.expense_id, ExpenseEvent.before, ExpenseEvent.after)
+        .where(ExpenseEvent.group_id == group_id, ExpenseEvent.occurred_at > when)
+        .order_by(ExpenseEvent.occurred_at, ExpenseEvent.id)
+        .execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE'])
+    )
+
+
+def expenses_as_of(group_id, when):
+    """Yield ``(id, date_entered, amount_eur, note, status, user_id)`` for
+    every expense of a group as it stood at ``when``, in id order.
+    """
+    first_before, last_after = {}, {}
+    for expense_id, before, after in _events_after(group_id, when):
+        first_before.setdefault(expense_id, before)
+        last_after[expense_id] = after
+
+    def restored(expense_id, values):
+        return (expense_id, datetime.fromisoformat(values['date_entered']),
+                Decimal(values['amount_eur']), values['note'], values['status'],
+                values['user_id'])
+
+    # Deleted since, so no longer in the table
+    deleted = sorted(expense_id for expense_id, after in last_after.items()
+                     if after is None and first_before[expense_id] is not None)
+    current = db.session.execute(
+        select(Expense.id, *(getattr(Expense, name) for name in EXPENSE_FIELDS))
+        .where(Expense.group_id == group_id)
+        .order_by(Expense.id)
+        .execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE'])
+    )
+    for row in current:
+        while deleted and deleted[0] < row.id:
+            expense_id = deleted.pop(0)
+            yield restored(expense_id, first_before[expense_id])
+        if row.id not in first_before:
+            yield tuple(row)
+        elif first_before[row.id] is not None:
+            yield restored(row.id, first_before[row.id])
+    for expense_id in deleted:
+        yield restored(expense_id, first_before[expense_id])
+
+
+def balances_as_of(group_id, when):
+    """A group's balance summary for the settlement period open at ``when``.
+
+    Starts from the ledger's all-time totals and takes back every change
+    logged since, so it reads the events after ``when`` but not ``expense``.
+    """
+    totals = defaultdict(lambda: [Decimal('0.00'), 0])
+    for user_id, paid, count in db.session.query(
+        UserBalance.user_id, UserBalance.total_paid, UserBalance.expense_count
+    ).filter(UserBalance.group_id == group_id):
+        totals[user_id] = [Decimal(paid), count]
+    for _, before, after in _events_after(group_id, when):
+        for values, sign in ((after, -1), (before, 1)):
+            if values is not None:
+                entry = totals[values['user_id']]
+                entry[0] += sign * Decimal(values['amount_eur'])
+                entry[1] += sign
+    return period_balances(group_id, totals, when)
+
+
+def init_app(app):
+    name = app.config['AUDIT_LOG_MODE']
+    if name not in MODES:
+        # A typo must not silently turn the log off
+        raise ValueError(f'Unknown AUDIT_LOG_MODE: {name!r}')
+    app.extensions['audit_writer'] = AuditWriter(app)
+    if not event.contains(RoutingSession, 'before_commit', _write_in_transaction):
+        event.listen(RoutingSession, 'before_commit', _write_in_transaction)
+        event.listen(RoutingSession, 'after_commit', _hand_to_writer)
+        event.listen(RoutingSession, 'after_rollback', _discard)
@@ -0,0 +1,191 @@
+"""Balance engine shared by the dashboard and admin views.
+
+Everything is computed in ``Decimal`` from a single query over the users and
+their ledger rows, so the totals shown never drift from the stored cents.
+
+Balances are per group and cover its current settlement period only: each
+member's all-time ledger totals minus the cumulative totals frozen in the
+group's latest :class:`~app.models.SettlementShare`. Neither side scans
+``expense``, and the cost is split between the group's own members.
+"""
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import and_, func, select
+
+from app import db
+from app.models import User, GroupMembership, UserBalance, Settlement, SettlementShare
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def to_cents(value):
+    return Decimal(value or 0).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class MemberBalance:
+    user_id: int
+    name: str
+    total_paid: Decimal
+    expense_count: int
+    balance: Decimal
+
+    @property
+    def owes(self):
+        return -self.balance if self.balance < 0 else ZERO
+
+    @property
+    def owed(self):
+        return self.balance if self.balance > 0 else ZERO
+
+
+@dataclass(frozen=True)
+class BalanceSummary:
+    total_expenses: Decimal
+    member_count: int
+    cost_per_person: Decimal
+    members: tuple
+    # When the current period began (the last settlement), None if never settled
+    period_start: object = None
+
+
+@dataclass(frozen=True)
+class Transfer:
+    from_user_id: int
+    from_name: str
+    to_user_id: int
+    to_name: str
+    amount: Decimal
+
+
+def _period_rows(group_id):
+    """Per-member ledger totals and the totals at the last settlement, in one query"""
+    latest_id = select(func.max(Settlement.id)).where(
+        Settlement.group_id == group_id
+    ).scalar_subquery()
+    return db.session.query(
+        User.id,
+        User.full_name,
+        func.coalesce(UserBalance.total_paid, 0),
+        func.coalesce(UserBalance.expense_count, 0),
+        func.coalesce(SettlementShare.cumulative_paid, 0),
+        func.coalesce(SettlementShare.cumulative_count, 0),
+        Settlement.closed_at
+    ).join(
+        GroupMembership, and_(GroupMembership.user_id == User.id,
+                              GroupMembership.group_id == group_id)
+    ).outerjoin(
+        UserBalance, and_(UserBalance.group_id == group_id, UserBalance.user_id == User.id)
+    ).outerjoin(
+        Settlement, Settlement.id == latest_id
+    ).outerjoin(
+        SettlementShare, and_(SettlementShare.settlement_id == Settlement.id,
+                              SettlementShare.user_id == User.id)
+    ).all()
+
+
+def _summarize(rows):
+    period_paid = [(user_id, name, to_cents(Decimal(paid) - Decimal(paid_before)),
+                    count - count_before)
+                   for user_id, name, paid, count, paid_before, count_before, _ in rows]
+
+    total_expenses = to_cents(sum((paid for _, _, paid, _ in period_paid), ZERO))
+    member_count = len(rows)
+    cost_per_person = to_cents(total_expenses / member_count) if member_count else ZERO
+
+    members = []
+    for user_id, name, total_paid, expense_count in period_paid:
+        members.append(MemberBalance(
+            user_id=user_id,
+            name=name,
+            total_paid=total_paid,
+            expense_count=expense_count,
+            balance=total_paid - cost_per_person
+        ))
+    members.sort(key=lambda m: (-m.total_paid, m.name))
+
+    return BalanceSummary(
+        total_expenses=total_expenses,
+        member_count=member_count,
+        cost_per_person=cost_per_person,
+        members=tuple(members),
+        period_start=rows[0][-1] if rows else None
+    )
+
+
+def compute_balances(group_id):
+    """Return a group's :class:`BalanceSummary` for the current period, in one query.
+
+    Members are sorted by amount paid, highest first.
+    """
+    return _summarize(_period_rows(group_id))
+
+
+def period_balances(group_id, totals, when):
+    """Return the group's :class:`BalanceSummary` of the period open at ``when``.
+
+    ``totals`` are members' all-time ``{user_id: (paid, count)}`` in the
+    group as of ``when``; the period starts at the group's last settlement
+    closed by then. Members are the group's current ones.
+    """
+    settlement_id = select(func.max(Settlement.id)).where(
+        Settlement.group_id == group_id, Settlement.closed_at <= when
+    ).scalar_subquery()
+    rows = db.session.query(
+        User.id,
+        User.full_name,
+        func.coalesce(SettlementShare.cumulative_paid, 0),
+        func.coalesce(SettlementShare.cumulative_count, 0),
+        Settlement.closed_at
+    ).select_from(User).join(
+        GroupMembership, and_(GroupMembership.user_id == User.id,
+                              GroupMembership.group_id == group_id)
+    ).outerjoin(
+        Settlement, Settlement.id == settlement_id
+    ).outerjoin(
+        SettlementShare, and_(SettlementShare.settlement_id == Settlement.id,
+                              SettlementShare.user_id == User.id)
+    ).all()
+    return _summarize([
+        (user_id, name, *totals.get(user_id, (0, 0)), paid_before, count_before, closed_at)
+        for user_id, name, paid_before, count_before, closed_at in rows
+    ])
+
+
+def snapshot_balances(group_id):
+    """Return a group's current-period summary with each member's all-time totals.
+
+    The totals (``{user_id: (paid, count)}``) come from the same statement as
+    the summary, so storing them as the next period's baseline loses nothing.
+    """
+    rows = _period_rows(group_id)
+    cumulative = {row[0]: (to_cents(row[2]), row[3]) for row in rows}
+    return _summarize(rows), cumulative
+
+
+def settle_up(members):
+    """Transfers that bring every member's balance to zero.
+
+    Repeatedly pays the largest creditor from the largest debtor, which needs
+    at most one transfer fewer than there are members with a balance. Cents
+    lost to rounding the per-person cost stay where they are.
+    """
+    debtors = sorted(([m.owes, m.user_id, m.name] for m in members if m.owes), reverse=True)
+    creditors = sorted(([m.owed, m.user_id, m.name] for m in members if m.owed), reverse=True)
+
+    transfers = []
+    while debtors and creditors:
+        debtor, creditor = debtors[0], creditors[0]
+        amount = min(debtor[0], creditor[0])
+        transfers.append(Transfer(debtor[1], debtor[2], creditor[1], creditor[2], amount))
+        debtor[0] -= amount
+        creditor[0] -= amount
+        if not debtor[0]:
+            debtors.pop(0)
+        if not creditor[0]:
+            creditors.pop(0)
+        debtors.sort(reverse=True)
+        creditors.sort(reverse=True)
+    return transfers
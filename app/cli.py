@@ -0,0 +1,211 @@
+"""Maintenance commands, available as ``flask <command>``."""
+import csv
+import sys
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+from app.audit import expenses_as_of, balances_as_of
+from app.api import create_token
+from app.groups import create_group, add_member, remove_member
+from app.importer import import_expenses
+from app.ledger import rebuild_ledger
+from app.rollups import rebuild_rollups
+from app.models import User, ApiToken, Group
+
+group_option = click.option('--group', 'group_id', type=int,
+                            help='Household id; may be left out while there is only one.')
+
+
+def resolve_group(group_id):
+    """The ``Group`` for ``--group``, defaulting to the only one there is"""
+    if group_id is not None:
+        group = db.session.get(Group, group_id)
+        if group is None:
+            raise click.BadParameter(f'no group with id {group_id}', param_hint='--group')
+        return group
+    groups = Group.query.order_by(Group.id).limit(2).all()
+    if len(groups) != 1:
+        raise click.BadParameter('there are several households; choose one',
+                                 param_hint='--group')
+    return groups[0]
+
+
+def user_by_email(email, param_hint):
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.BadParameter(f'no user with email {email}', param_hint=param_hint)
+    return user
+
+
+@click.command('reconcile-ledger')
+@click.option('--dry-run', is_flag=True, help='Report drift without fixing it.')
+@with_appcontext
+def reconcile_ledger_command(dry_run):
+    """Rebuild the per-user balance ledger from the expense table."""
+    drift = rebuild_ledger(dry_run=dry_run)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+    if not drift:
+        click.echo('✓ Ledger matches the expense table.')
+        return
+    for entry in drift:
+        click.echo(f'  group {entry.group_id} user {entry.user_id} {entry.field}: '
+                   f'stored {entry.stored}, expected {entry.expected}')
+    verb = 'found' if dry_run else 'corrected'
+    click.echo(f'✗ {len(drift)} ledger value(s) {verb}.')
+    if dry_run:
+        raise SystemExit(1)
+
+
+@click.command('refresh-rollups')
+@with_appcontext
+def refresh_rollups_command():
+    """Recompute the monthly reporting rollups from the expense table."""
+    started = time.perf_counter()
+    count = rebuild_rollups()
+    db.session.commit()
+    click.echo(f'✓ Rebuilt {count} rollup row(s) in {time.perf_counter() - started:.2f}s.')
+
+
+@click.command('import-expenses')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--user', 'user_email',
+              help='Author for rows without a user_email column value.')
+@click.option('--batch-size', type=int, help='Rows per batched insert.')
+@group_option
+@with_appcontext
+def import_expenses_command(csv_file, user_email, batch_size, group_id):
+    """Bulk import expenses from a CSV file into a household."""
+    group = resolve_group(group_id)
+    default_user_id = user_by_email(user_email, '--user').id if user_email else None
+
+    started = time.perf_counter()
+    report = import_expenses(csv_file, group.id, default_user_id=default_user_id,
+                             batch_size=batch_size)
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+
+    for line, message in report.errors:
+        click.echo(f'  line {line}: {message}')
+    if report.error_count > len(report.errors):
+        click.echo(f'  ... and {report.error_count - len(report.errors)} more')
+    rate = report.inserted / elapsed if elapsed else 0
+    click.echo(f'✓ Imported {report.inserted} expense(s) in {elapsed:.2f}s ({rate:,.0f} rows/s)')
+    if report.error_count:
+        click.echo(f'✗ Skipped {report.error_count} invalid row(s).')
+
+
+@click.command('create-api-token')
+@click.argument('email')
+@click.option('--name', default='API token', help='Label to recognise the token by.')
+@group_option
+@with_appcontext
+def create_api_token_command(email, name, group_id):
+    """Create a bearer token for the JSON API, acting as EMAIL in one household."""
+    user = user_by_email(email, 'EMAIL')
+    group = resolve_group(group_id)
+    if group not in user.groups:
+        raise click.BadParameter(f'{email} is not a member of {group.name}', param_hint='EMAIL')
+    api_token, token = create_token(user.id, group.id, name)
+    db.session.commit()
+    click.echo(f'✓ Created token {api_token.id} ({name}) for {user.full_name} in {group.name}.')
+    click.echo('  Store it now; it cannot be shown again:')
+    click.echo(f'  {token}')
+
+
+@click.command('revoke-api-token')
+@click.argument('token_id', type=int)
+@with_appcontext
+def revoke_api_token_command(token_id):
+    """Revoke the API token with id TOKEN_ID."""
+    deleted = ApiToken.query.filter_by(id=token_id).delete()
+    db.session.commit()
+    if not deleted:
+        click.echo(f'✗ No API token with id {token_id}.')
+        raise SystemExit(1)
+    click.echo(f'✓ Revoked token {token_id}.')
+
+
+@click.command('replay-expenses')
+@click.option('--as-of', 'as_of', required=True,
+              type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']),
+              help='Point in time (UTC) to rebuild.')
+@click.option('--balances', is_flag=True,
+              help='Print the balances at that time instead of the expenses.')
+@group_option
+@with_appcontext
+def replay_expenses_command(as_of, balances, group_id):
+    """Rebuild a household's expenses (as CSV) or balances as of a time from the audit log."""
+    group_id = resolve_group(group_id).id
+    if not balances:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(('id', 'date_entered', 'amount_eur', 'note', 'status', 'user_id'))
+        for row in expenses_as_of(group_id, as_of):
+            writer.writerow((row[0], row[1].isoformat(sep=' ')) + tuple(row[2:]))
+        return
+
+    summary = balances_as_of(group_id, as_of)
+    period_start = summary.period_start.isoformat(sep=' ') if summary.period_start else 'the beginning'
+    click.echo(f'Balances as of {as_of.isoformat(sep=" ")} (period since {period_start})')
+    click.echo(f'  Total €{summary.total_expenses}, €{summary.cost_per_person} per person')
+    for member in summary.members:
+        click.echo(f'  {member.name:<30} paid €{member.total_paid:>10} '
+                   f'({member.expense_count} expense(s))  balance €{member.balance:>10}')
+
+
+@click.command('create-group')
+@click.argument('name')
+@click.option('--member', 'member_emails', multiple=True, help='Email of a member; repeatable.')
+@with_appcontext
+def create_group_command(name, member_emails):
+    """Create a household called NAME."""
+    members = [user_by_email(email, '--member') for email in member_emails]
+    group = create_group(name, [user.id for user in members])
+    db.session.commit()
+    click.echo(f'✓ Created group {group.id} ({name}) with {len(members)} member(s).')
+
+
+@click.command('add-member')
+@click.argument('group_id', type=int)
+@click.argument('email')
+@with_appcontext
+def add_member_command(group_id, email):
+    """Add the user with EMAIL to the household GROUP_ID."""
+    group = resolve_group(group_id)
+    user = user_by_email(email, 'EMAIL')
+    add_member(group.id, user.id)
+    db.session.commit()
+    click.echo(f'✓ {user.full_name} is a member of {group.name}.')
+
+
+@click.command('remove-member')
+@click.argument('group_id', type=int)
+@click.argument('email')
+@with_appcontext
+def remove_member_command(group_id, email):
+    """Remove the user with EMAIL from the household GROUP_ID."""
+    group = resolve_group(group_id)
+    user = user_by_email(email, 'EMAIL')
+    if not remove_member(group.id, user.id):
+        click.echo(f'✗ {user.full_name} is not a member of {group.name}.')
+        raise SystemExit(1)
+    db.session.commit()
+    click.echo(f'✓ {user.full_name} is no longer a member of {group.name}.')
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_ledger_command)
+    app.cli.add_command(import_expenses_command)
+    app.cli.add_command(refresh_rollups_command)
+    app.cli.add_command(create_api_token_command)
+    app.cli.add_command(revoke_api_token_command)
+    app.cli.add_command(replay_expenses_command)
+    app.cli.add_command(create_group_command)
+    app.cli.add_command(add_member_command)
+    app.cli.add_command(remove_member_command)
@@ -0,0 +1,54 @@
+"""Streaming expense export.
+
+Rows are read through a server-side cursor (``yield_per``) as plain tuples
+and written out as they arrive, so memory use stays flat and the first
+bytes go out immediately no matter how large the table is.
+"""
+import csv
+import io
+import json
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.models import User, Expense, expense_json
+
+EXPORT_COLUMNS = ('id', 'date_entered', 'amount_eur', 'note', 'status',
+                  'user_id', 'user_email', 'user_name')
+
+# Flush the CSV buffer to the client once it grows past this many characters
+_CSV_CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(criteria):
+    """Yield ``EXPORT_COLUMNS`` rows (joined to their author) in id order"""
+    stmt = select(
+        Expense.id, Expense.date_entered, Expense.amount_eur, Expense.note, Expense.status,
+        Expense.user_id, User.email.label('user_email'), User.full_name.label('user_name')
+    ).join(
+        User, User.id == Expense.user_id
+    ).where(*criteria).order_by(Expense.id)
+
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def generate_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow((row[0], row[1].isoformat(sep=' '), row[2]) + tuple(row[3:]))
+        if buffer.tell() > _CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def generate_ndjson(rows):
+    for row in rows:
+        yield json.dumps(expense_json(row._mapping, EXPORT_COLUMNS), ensure_ascii=False) + '\n'
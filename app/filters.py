@@ -0,0 +1,68 @@
+"""Expense filters shared by the listing, export and search views."""
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from app.models import Expense
+
+EXPENSE_STATUSES = ('unsettled', 'settled')
+# Arguments read by ``expense_criteria``
+EXPENSE_FILTERS = ('from', 'to', 'min_amount', 'max_amount', 'status', 'user_id')
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError as e:
+        raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format") from e
+
+
+def _parse_amount(value, name):
+    try:
+        amount = Decimal(value)
+    except InvalidOperation as e:
+        raise ValueError(f"'{name}' must be a number") from e
+    if not amount.is_finite():
+        raise ValueError(f"'{name}' must be a number")
+    return amount
+
+
+def parse_status(value):
+    if value not in EXPENSE_STATUSES:
+        raise ValueError(f"'status' must be one of: {', '.join(EXPENSE_STATUSES)}")
+    return value
+
+
+def parse_user_id(value):
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ValueError("'user_id' must be an integer") from e
+
+
+def filter_args(args, names):
+    """The non-empty ``names`` of ``args``, to carry over into links"""
+    return {name: args[name] for name in names if args.get(name)}
+
+
+def expense_criteria(group_id, args):
+    """Build SQLAlchemy criteria for a group's expenses from request arguments.
+
+    Supported arguments: ``from`` and ``to`` (inclusive dates, YYYY-MM-DD),
+    ``min_amount`` and ``max_amount`` (inclusive, EUR), ``status`` and
+    ``user_id``. Raises ``ValueError`` on invalid input.
+    """
+    criteria = [Expense.group_id == group_id]
+    if args.get('from'):
+        criteria.append(Expense.date_entered >= _parse_date(args['from'], 'from'))
+    if args.get('to'):
+        end = _parse_date(args['to'], 'to') + timedelta(days=1)
+        criteria.append(Expense.date_entered < end)
+    if args.get('min_amount'):
+        criteria.append(Expense.amount_eur >= _parse_amount(args['min_amount'], 'min_amount'))
+    if args.get('max_amount'):
+        criteria.append(Expense.amount_eur <= _parse_amount(args['max_amount'], 'max_amount'))
+    if args.get('status'):
+        criteria.append(Expense.status == parse_status(args['status']))
+    if args.get('user_id'):
+        criteria.append(Expense.user_id == parse_user_id(args['user_id']))
+    return criteria
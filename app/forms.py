@@ -1,6 +1,13 @@
+from decimal import Decimal
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, DecimalField, SubmitField, HiddenField
-from wtforms.validators import DataRequired, Email, EqualTo, NumberRange
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import (StringField, PasswordField, TextAreaField, DecimalField, SubmitField, HiddenField,
+                     IntegerField)
+from wtforms.validators import DataRequired, Email, EqualTo, NumberRange, Optional
+from wtforms.widgets import HiddenInput
+
+# Shared with the bulk importer so both paths accept the same amounts
+MIN_EXPENSE_AMOUNT = Decimal('0.01')
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -15,13 +22,19 @@ class ChangePasswordForm(FlaskForm):
 
 class ExpenseForm(FlaskForm):
     amount_eur = DecimalField('Amount (EUR)', places=2, 
-                             validators=[DataRequired(), NumberRange(min=0.01)])
+                             validators=[DataRequired(), NumberRange(min=MIN_EXPENSE_AMOUNT)])
     note = TextAreaField('Note', validators=[DataRequired()])
     submit = SubmitField('Add Expense')
 
 class EditExpenseForm(FlaskForm):
     expense_id = HiddenField()
+    # The expense version the form was filled from, to detect concurrent edits
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
     amount_eur = DecimalField('Amount (EUR)', places=2, 
-                             validators=[DataRequired(), NumberRange(min=0.01)])
+                             validators=[DataRequired(), NumberRange(min=MIN_EXPENSE_AMOUNT)])
     note = TextAreaField('Note', validators=[DataRequired()])
-    submit = SubmitField('Update Expense') 
\ No newline at end of file
+    submit = SubmitField('Update Expense')
+
+class ImportExpensesForm(FlaskForm):
+    file = FileField('CSV File', validators=[FileRequired(), FileAllowed(['csv'], 'CSV files only')])
+    submit = SubmitField('Import Expenses')
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Rendered-fragment caching and conditional GETs keyed on the data version.
+
+Every expense write bumps its group's :class:`~app.models.DataVersion` in
+its own transaction. Views read the version first and use it, with the group,
+to key cached HTML fragments and to build an ``ETag``, so a repeat view
+between writes costs one version lookup and either a ``304 Not Modified`` or
+a page assembled from cached pieces. Writes in one group never invalidate
+another group's pages.
+"""
+import hashlib
+import time
+
+from flask import current_app, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import update
+
+from app import db
+from app.models import DataVersion
+from app.user_cache import MemoryBackend
+
+
+def current_data_version(group_id):
+    return db.session.query(DataVersion.version).filter_by(group_id=group_id).scalar() or 0
+
+
+def bump_data_version(group_id):
+    """Mark a group's expense data as changed, in the caller's transaction"""
+    db.session.execute(
+        update(DataVersion)
+        .where(DataVersion.group_id == group_id)
+        .values(version=DataVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def viewer_scope():
+    """Cache scope for content that depends on who is looking.
+
+    Admins all see the same thing; members see edit buttons on their own
+    expenses only, so their scope includes their id.
+    """
+    return 'admin' if current_user.is_admin else f'member:{current_user.id}'
+
+
+def cached_fragment(name, group_id, version, scope, render):
+    """Return the HTML for a fragment, calling ``render()`` only on a miss"""
+    cache = current_app.extensions['fragment_cache']
+    key = (name, group_id, version, scope)
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html)
+    return Markup(html)
+
+
+def page_etag(name, group_id, version):
+    """ETag for a page built from a group's ``version`` for the current user.
+
+    Includes the CSRF token window so a revalidated page never carries a
+    token that has expired.
+    """
+    csrf_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    csrf_window = int(time.time() // (csrf_limit / 2)) if csrf_limit else 0
+    parts = (name, group_id, version, current_user.id, current_user.full_name,
+             current_user.is_admin, current_user.groups, csrf_window,
+             current_app.config['ETAG_SALT'])
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def is_not_modified(etag):
+    """True if the client already has this exact page.
+
+    Never true while flash messages are pending, since they must be rendered.
+    """
+    return '_flashes' not in session and request.if_none_match.contains(etag)
+
+
+def set_validators(response, etag):
+    response.set_etag(etag)
+    # Let the browser keep the page but revalidate it on every view
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def init_app(app):
+    app.extensions['fragment_cache'] = MemoryBackend(
+        app.config['FRAGMENT_CACHE_TTL'], app.config['FRAGMENT_CACHE_SIZE']
+    )
@@ -0,0 +1,71 @@
+"""Households ("groups") sharing one deployment.
+
+Every expense belongs to a :class:`~app.models.Group`, and everything derived
+from expenses - the balance ledger, rollups, settlements, the data version -
+is kept per group. Views never take a group from the request: they work in
+:func:`current_group_id`, which is always one the user is a member of.
+
+A signed-in user works in one group at a time, chosen with
+:func:`select_group` and remembered in the session; API tokens are issued
+for a single group.
+"""
+from flask import abort, g, has_request_context, session
+from flask_login import current_user
+
+from app import db
+from app.fragments import bump_data_version
+from app.models import Group, GroupMembership, DataVersion
+
+# Name of the group an existing single-household database is moved into
+DEFAULT_GROUP_NAME = 'Arteon Villas'
+
+
+def create_group(name, user_ids=()):
+    """Create a group with the given members; the caller commits"""
+    group = Group(name=name)
+    db.session.add(group)
+    db.session.flush()
+    db.session.add(DataVersion(group_id=group.id, version=0))
+    for user_id in user_ids:
+        add_member(group.id, user_id)
+    return group
+
+
+def add_member(group_id, user_id):
+    """Add a user to a group unless already a member; the caller commits"""
+    if db.session.get(GroupMembership, (group_id, user_id)) is None:
+        db.session.add(GroupMembership(group_id=group_id, user_id=user_id))
+        # The member count changes everyone's share
+        bump_data_version(group_id)
+
+
+def remove_member(group_id, user_id):
+    """Remove a user from a group; False if not a member. The caller commits"""
+    membership = db.session.get(GroupMembership, (group_id, user_id))
+    if membership is None:
+        return False
+    db.session.delete(membership)
+    bump_data_version(group_id)
+    return True
+
+
+def current_group_id():
+    """The group the current request works in.
+
+    Aborts with 403 if the user belongs to no group at all.
+    """
+    if has_request_context() and 'api_group_id' in g:
+        return g.api_group_id
+    group_ids = current_user.group_ids
+    if not group_ids:
+        abort(403, 'You are not a member of any household.')
+    chosen = session.get('group_id')
+    return chosen if chosen in group_ids else group_ids[0]
+
+
+def select_group(group_id):
+    """Switch the current user to ``group_id``; False if not a member"""
+    if group_id not in current_user.group_ids:
+        return False
+    session['group_id'] = group_id
+    return True
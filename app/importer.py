@@ -0,0 +1,202 @@
+"""Bulk expense import from CSV.
+
+Rows are validated with the same rules as ``ExpenseForm`` and inserted in
+large batches: ``COPY`` on PostgreSQL, multi-row ``INSERT`` elsewhere. Invalid
+rows are reported by line number and skipped; they never abort the file.
+
+Expected columns (header row required):
+
+* ``amount_eur`` and ``note`` - required
+* ``user_email`` - author, a member of the group imported into; falls back
+  to the importing user when blank
+* ``date_entered`` - ISO date or date-time; defaults to now
+* ``status`` - ``unsettled`` (default) or ``settled``
+"""
+import csv
+import io
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+from sqlalchemy import func, insert, select, text
+
+from app import audit, db, ledger, live, rollups
+from app.fragments import bump_data_version
+from app.filters import EXPENSE_STATUSES
+from app.forms import MIN_EXPENSE_AMOUNT
+from app.models import User, Expense, GroupMembership
+
+# Largest value that fits Expense.amount_eur (Numeric(10, 2))
+MAX_EXPENSE_AMOUNT = Decimal('99999999.99')
+
+# Stop collecting error details after this many; the count keeps going
+MAX_REPORTED_ERRORS = 1000
+
+_COPY_COLUMNS = ('id', 'group_id', 'date_entered', 'amount_eur', 'note', 'user_id', 'status')
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def parse_row(row, users_by_email, default_user_id, now):
+    """Validate one CSV row and return the expense values to insert.
+
+    Raises ``ValueError`` with a readable message if the row is invalid.
+    """
+    raw_amount = (row.get('amount_eur') or '').strip()
+    if not raw_amount:
+        raise ValueError('amount_eur is required')
+    try:
+        amount = Decimal(raw_amount)
+    except InvalidOperation:
+        raise ValueError(f'amount_eur is not a number: {raw_amount!r}')
+    if not amount.is_finite() or amount < MIN_EXPENSE_AMOUNT:
+        raise ValueError(f'amount_eur must be at least {MIN_EXPENSE_AMOUNT}')
+    if amount > MAX_EXPENSE_AMOUNT:
+        raise ValueError(f'amount_eur must be at most {MAX_EXPENSE_AMOUNT}')
+
+    note = (row.get('note') or '').strip()
+    if not note:
+        raise ValueError('note is required')
+
+    email = (row.get('user_email') or '').strip().lower()
+    if email:
+        user_id = users_by_email.get(email)
+        if user_id is None:
+            raise ValueError(f'user_email is not a member of this group: {email}')
+    elif default_user_id is not None:
+        user_id = default_user_id
+    else:
+        raise ValueError('user_email is required')
+
+    raw_date = (row.get('date_entered') or '').strip()
+    try:
+        date_entered = datetime.fromisoformat(raw_date) if raw_date else now
+    except ValueError:
+        raise ValueError(f'date_entered is not an ISO date: {raw_date!r}')
+
+    status = (row.get('status') or '').strip().lower() or 'unsettled'
+    if status not in EXPENSE_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(EXPENSE_STATUSES)}")
+
+    return {
+        'date_entered': date_entered,
+        'amount_eur': amount.quantize(Decimal('0.01')),
+        'note': note,
+        'user_id': user_id,
+        'status': status,
+    }
+
+
+def _copy_batch(records):
+    """Load a batch with PostgreSQL COPY on the session's connection"""
+    # COPY cannot return the ids it assigns, so take them from the sequence
+    # first; the audit log needs them
+    ids = db.session.execute(text(
+        "SELECT nextval(pg_get_serial_sequence('expense', 'id')) FROM generate_series(1, :count)"
+    ), {'count': len(records)}).scalars()
+    for record, expense_id in zip(records, ids):
+        record['id'] = expense_id
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow([record[column] for column in _COPY_COLUMNS])
+    buffer.seek(0)
+
+    dbapi_connection = db.session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY expense ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+
+def insert_batch(group_id, records):
+    """Insert validated expense values into a group and update derived data to match.
+
+    Sets each record's ``group_id``, and its ``id`` when the audit log needs
+    it or on PostgreSQL.
+    """
+    if not records:
+        return
+    for record in records:
+        record['group_id'] = group_id
+    audited = audit.mode() != 'off'
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _copy_batch(records)
+    else:
+        # Returning ids in order would mean one statement per row on SQLite
+        db.session.execute(insert(Expense), records)
+        if audited:
+            # The transaction holds SQLite's write lock since the insert, so
+            # the batch got the newest ids, one after the other
+            last_id = db.session.execute(select(func.max(Expense.id))).scalar()
+            for expense_id, record in enumerate(records, last_id - len(records) + 1):
+                record['id'] = expense_id
+
+    totals = defaultdict(lambda: [Decimal('0.00'), 0, Decimal('0.00')])
+    changes = rollups.RollupChanges()
+    for record in records:
+        if audited:
+            audit.record('created', record['id'], after=audit.snapshot(record))
+        entry = totals[record['user_id']]
+        entry[0] += record['amount_eur']
+        entry[1] += 1
+        if record['status'] == 'unsettled':
+            entry[2] += record['amount_eur']
+        changes.add(group_id, record['date_entered'], record['user_id'], record['status'],
+                    record['amount_eur'], 1)
+    for user_id, (paid, count, unsettled) in totals.items():
+        ledger.record(group_id, user_id, paid=paid, count=count, unsettled=unsettled)
+    rollups.record(changes)
+    bump_data_version(group_id)
+    live.publish('refresh', group_id=group_id)
+
+
+def import_expenses(stream, group_id, default_user_id=None, batch_size=None):
+    """Import expenses into a group from a text stream of CSV data.
+
+    Valid rows are inserted in batches of ``batch_size`` within the caller's
+    transaction; the caller commits. Returns an :class:`ImportReport`.
+    """
+    if batch_size is None:
+        batch_size = current_app.config['IMPORT_BATCH_SIZE']
+
+    report = ImportReport()
+    reader = csv.DictReader(stream)
+    missing = {'amount_eur', 'note'} - set(reader.fieldnames or ())
+    if missing:
+        report.add_error(1, f"missing column(s): {', '.join(sorted(missing))}")
+        return report
+
+    users_by_email = dict(db.session.query(func.lower(User.email), User.id).join(
+        GroupMembership, GroupMembership.user_id == User.id
+    ).filter(GroupMembership.group_id == group_id))
+    now = datetime.utcnow()
+    batch = []
+    for row in reader:
+        try:
+            batch.append(parse_row(row, users_by_email, default_user_id, now))
+        except ValueError as e:
+            report.add_error(reader.line_num, str(e))
+            continue
+        if len(batch) >= batch_size:
+            insert_batch(group_id, batch)
+            report.inserted += len(batch)
+            batch = []
+
+    insert_batch(group_id, batch)
+    report.inserted += len(batch)
+    return report
@@ -0,0 +1,183 @@
+"""Per-request SQL and render instrumentation.
+
+For every request this records how many SQL statements ran, how long they
+took, how long template rendering took and the total time. The numbers are
+sent back as a ``Server-Timing`` header and aggregated into per-endpoint
+histograms served in Prometheus text format at ``/metrics`` (admins, plus
+localhost when ``METRICS_ALLOW_LOCAL`` is set). Histograms are per process;
+with several gunicorn workers each scrape sees the worker that answered it.
+
+Views can also declare how many SQL statements they may issue with
+:func:`query_budget`. Going over budget logs a warning, or raises
+:class:`QueryBudgetExceeded` when ``QUERY_BUDGET_STRICT`` is set or the app is
+under test, so N+1 regressions fail loudly instead of slowly.
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import (Response, abort, before_render_template, current_app, g,
+                   has_app_context, request, template_rendered)
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the statements-per-request histogram buckets
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram, labelled by endpoint"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.setdefault(endpoint, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for endpoint in sorted(self._series):
+                counts, total, count = self._series[endpoint]
+                label = f'endpoint="{endpoint}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('app_request_duration_seconds',
+                             'Total time spent handling the request.', DURATION_BUCKETS)
+DB_DURATION = Histogram('app_db_duration_seconds',
+                        'Time spent executing SQL statements per request.', DURATION_BUCKETS)
+RENDER_DURATION = Histogram('app_render_duration_seconds',
+                            'Time spent rendering templates per request.', DURATION_BUCKETS)
+DB_QUERIES = Histogram('app_db_queries_per_request',
+                       'SQL statements issued per request.', QUERY_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, DB_DURATION, RENDER_DURATION, DB_QUERIES)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started and has_app_context():
+        g.db_time = g.get('db_time', 0.0) + time.perf_counter() - started.pop()
+
+
+def _start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _end_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        g.render_time = g.get('render_time', 0.0) + time.perf_counter() - started
+
+
+def query_count():
+    """Number of SQL statements issued so far in this request"""
+    return g.get('query_count', 0)
+
+
+def query_budget(limit):
+    """Declare the maximum number of SQL statements a view may issue.
+
+    The count covers the whole request, including loading the logged-in user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.query_budget = limit
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.db_time = 0.0
+    g.render_time = 0.0
+
+
+def _check_budget():
+    budget = g.get('query_budget')
+    if budget is None or query_count() <= budget:
+        return
+
+    message = (f'{request.endpoint} issued {query_count()} SQL statements, '
+               f'over its budget of {budget}')
+    if current_app.config['QUERY_BUDGET_STRICT'] or current_app.testing:
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+
+
+def _finish_request(response):
+    _check_budget()
+
+    total = time.perf_counter() - g.get('request_started', time.perf_counter())
+    db_time = g.get('db_time', 0.0)
+    render_time = g.get('render_time', 0.0)
+    endpoint = request.endpoint or 'unknown'
+
+    REQUEST_DURATION.observe(endpoint, total)
+    DB_DURATION.observe(endpoint, db_time)
+    RENDER_DURATION.observe(endpoint, render_time)
+    DB_QUERIES.observe(endpoint, query_count())
+
+    if current_app.config['SERVER_TIMING_HEADER']:
+        app_time = max(total - db_time - render_time, 0.0)
+        response.headers['Server-Timing'] = ', '.join((
+            f'db;dur={db_time * 1000:.1f};desc="{query_count()} queries"',
+            f'render;dur={render_time * 1000:.1f}',
+            f'app;dur={app_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+    return response
+
+
+def metrics():
+    """Prometheus scrape endpoint, for admins (and local scrapers if allowed)."""
+    is_local = (current_app.config['METRICS_ALLOW_LOCAL']
+                and request.remote_addr in ('127.0.0.1', '::1'))
+    if not is_local and not (current_user.is_authenticated and current_user.is_admin):
+        abort(404)
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
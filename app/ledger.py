@@ -0,0 +1,106 @@
+"""Incrementally maintained balance ledger, one row per group member.
+
+Every expense mutation calls :func:`record` with the change it makes, inside
+the same transaction, so ``user_balance`` always matches ``expense`` without
+rescanning it. :func:`rebuild_ledger` recomputes the table from scratch and
+reports any drift it corrected.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from sqlalchemy import case, event, func, insert, update
+
+from app import db
+from app.models import Expense, GroupMembership, UserBalance
+
+LedgerDrift = namedtuple('LedgerDrift', 'group_id user_id field stored expected')
+
+_FIELDS = ('total_paid', 'expense_count', 'unsettled_total')
+
+
+@event.listens_for(GroupMembership, 'after_insert')
+def _open_ledger_row(mapper, connection, membership):
+    """Give every new member an empty ledger row in the same transaction"""
+    connection.execute(insert(UserBalance).values(
+        group_id=membership.group_id, user_id=membership.user_id,
+        total_paid=0, expense_count=0, unsettled_total=0
+    ))
+
+
+def record(group_id, user_id, paid=0, count=0, unsettled=0):
+    """Apply deltas to a member's ledger row in the current transaction.
+
+    Uses ``SET col = col + delta`` so concurrent writers never overwrite each
+    other. If the member has no ledger row yet, one is created from their
+    expenses (after flushing, so the pending change is included).
+    """
+    result = db.session.execute(
+        update(UserBalance)
+        .where(UserBalance.group_id == group_id, UserBalance.user_id == user_id)
+        .values(total_paid=UserBalance.total_paid + paid,
+                expense_count=UserBalance.expense_count + count,
+                unsettled_total=UserBalance.unsettled_total + unsettled)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.flush()
+        totals = _expense_totals(Expense.group_id == group_id,
+                                 Expense.user_id == user_id).get((group_id, user_id))
+        db.session.add(UserBalance(group_id=group_id, user_id=user_id, **(totals or _zero())))
+
+
+def record_settled(group_id, amounts_by_user):
+    """Move settled amounts out of each member's unsettled total"""
+    for user_id, amount in amounts_by_user.items():
+        record(group_id, user_id, unsettled=-amount)
+
+
+def _zero():
+    return {'total_paid': Decimal('0.00'), 'expense_count': 0,
+            'unsettled_total': Decimal('0.00')}
+
+
+def _expense_totals(*criteria):
+    """Aggregate the expense table per group and user, straight from the source rows"""
+    rows = db.session.query(
+        Expense.group_id,
+        Expense.user_id,
+        func.coalesce(func.sum(Expense.amount_eur), 0),
+        func.count(Expense.id),
+        func.coalesce(func.sum(case((Expense.status == 'unsettled', Expense.amount_eur),
+                                    else_=0)), 0)
+    ).filter(*criteria).group_by(Expense.group_id, Expense.user_id).all()
+    return {
+        (group_id, user_id): {'total_paid': Decimal(total_paid), 'expense_count': count,
+                              'unsettled_total': Decimal(unsettled)}
+        for group_id, user_id, total_paid, count, unsettled in rows
+    }
+
+
+def rebuild_ledger(dry_run=False):
+    """Recompute every ledger row from ``expense`` and return the drift found.
+
+    Covers every group member, and anyone with expenses in a group they have
+    since left. The caller is responsible for committing. With ``dry_run``
+    the ledger is left untouched and only the drift is reported.
+    """
+    expected = _expense_totals()
+    stored = {(row.group_id, row.user_id): row for row in UserBalance.query.all()}
+    members = set(db.session.query(GroupMembership.group_id, GroupMembership.user_id))
+
+    drift = []
+    for group_id, user_id in sorted(members | set(expected)):
+        want = expected.get((group_id, user_id), _zero())
+        row = stored.get((group_id, user_id))
+        for field in _FIELDS:
+            have = getattr(row, field) if row is not None else None
+            if have is None or Decimal(have) != Decimal(want[field]):
+                drift.append(LedgerDrift(group_id, user_id, field, have, want[field]))
+        if dry_run:
+            continue
+        if row is None:
+            db.session.add(UserBalance(group_id=group_id, user_id=user_id, **want))
+        else:
+            for field in _FIELDS:
+                setattr(row, field, want[field])
+    return drift
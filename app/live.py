@@ -0,0 +1,284 @@
+"""Live dashboard updates over server-sent events.
+
+Expense writes queue small events on the session with :func:`publish`; they
+go out only once the transaction commits:
+
+* on PostgreSQL as a single ``NOTIFY expense_events`` issued inside the
+  committing transaction. Every worker process runs one listener thread with
+  its own ``LISTEN`` connection and relays the events to its subscribers, so
+  a write in one gunicorn worker reaches dashboards open on all of them;
+* elsewhere (SQLite, tests) straight to the subscribers in this process.
+
+Every event names its group, and a stream only receives its own group's.
+``/events`` turns them into deltas for the viewer - a rendered table row, a
+removed row id, the balance fragments - and the dashboard patches itself in
+place. Each message carries the data version as its SSE id, so a browser
+that reconnects after missing something gets one full refresh instead.
+"""
+import json
+import queue
+import select
+import threading
+import time
+
+from flask import current_app, render_template
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.fragments import current_data_version
+from app.models import Expense
+from app.routing import RoutingSession
+
+CHANNEL = 'expense_events'
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7500
+# Events waiting for a slow stream before it is told to refresh instead
+SUBSCRIBER_QUEUE_SIZE = 100
+# More row changes than this in one go are sent as a full refresh
+MAX_ROW_DELTAS = 20
+# How long the browser waits before reconnecting a closed stream
+RETRY_MS = 2000
+
+
+def _refresh(group_id=None):
+    """Everything on a group's dashboard (every group's, if None) may have changed"""
+    return {'type': 'refresh', 'group': group_id}
+
+
+def publish(event_type, expense=None, group_id=None):
+    """Queue an event for after the current transaction commits.
+
+    ``event_type`` is ``added``, ``changed`` or ``removed`` with the expense
+    concerned, or ``refresh`` with the ``group_id`` for changes to many of
+    its expenses at once.
+    """
+    if expense is not None:
+        group_id = expense.group_id
+    pending = db.session.info.setdefault('live_events', [])
+    if (event_type, group_id, expense) not in pending:
+        pending.append((event_type, group_id, expense))
+
+
+def _payload(pending):
+    events = []
+    for event_type, group_id, expense in pending:
+        if expense is None:
+            events.append(_refresh(group_id))
+        else:
+            # The primary key, without loading expired or deleted rows
+            events.append({'type': event_type, 'group': group_id,
+                           'id': inspect(expense).identity[0]})
+    if len(json.dumps(events)) > MAX_PAYLOAD:
+        return [_refresh(group_id) for group_id in {item['group'] for item in events}]
+    return events
+
+
+def _is_postgres(session):
+    return session.get_bind().dialect.name == 'postgresql'
+
+
+def _notify(session):
+    if not session.info.get('live_events') or not _is_postgres(session):
+        return
+    # New expenses only have their ids once flushed
+    session.flush()
+    session.connection().execute(text('SELECT pg_notify(:channel, :payload)'), {
+        'channel': CHANNEL,
+        'payload': json.dumps(_payload(session.info['live_events']))
+    })
+
+
+def _dispatch(session):
+    pending = session.info.pop('live_events', None)
+    if pending and not _is_postgres(session):
+        broker = current_app.extensions.get('live_updates')
+        if broker is not None:
+            broker.publish(_payload(pending))
+
+
+def _discard(session):
+    session.info.pop('live_events', None)
+
+
+class Subscription:
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        # Set when events had to be dropped; the stream then refreshes
+        self.overflowed = False
+
+    def put(self, events):
+        events = [item for item in events if item['group'] in (None, self.group_id)]
+        if not events:
+            return
+        try:
+            self.queue.put_nowait(events)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Events received within ``timeout`` seconds, merged; [] if none"""
+        try:
+            events = list(self.queue.get(timeout=timeout))
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.extend(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class Broker:
+    """Fans committed events out to the streams open in this process"""
+
+    def __init__(self, app):
+        self.app = app
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, group_id):
+        subscription = Subscription(group_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self._listener is None and db.engine.dialect.name == 'postgresql':
+                # Started lazily so it runs in the gunicorn worker, not the master
+                self._listener = threading.Thread(target=self._listen, args=(db.engine,),
+                                                  name='live-updates-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(events)
+
+    def _listen(self, engine):
+        while True:
+            try:
+                self._relay_notifications(engine)
+            except Exception:
+                self.app.logger.exception('Live updates listener lost its connection')
+            # Anything sent while reconnecting is lost
+            self.publish([_refresh()])
+            time.sleep(5)
+
+    def _relay_notifications(self, engine):
+        # A connection of its own, outside the pool, that stays in LISTEN
+        pooled = engine.raw_connection()
+        pooled.detach()
+        connection = pooled.driver_connection
+        try:
+            connection.autocommit = True
+            connection.cursor().execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([connection], [], [], 60) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    self.publish(json.loads(notification.payload))
+        finally:
+            pooled.close()
+
+
+def _message(event_name, data, version):
+    return f'id: {version}\nevent: {event_name}\ndata: {json.dumps(data)}\n\n'
+
+
+def _render_rows(expense_ids):
+    """Rendered ``<tr>`` per expense id; ids of deleted expenses are absent"""
+    expenses = Expense.query.options(joinedload(Expense.user)).filter(
+        Expense.id.in_(expense_ids)
+    ).all()
+    return {expense.id: render_template('_expense_rows.html', expenses=[expense],
+                                        admin_view=False)
+            for expense in expenses}
+
+
+def _deltas(events, version, fragments):
+    """The messages that bring a dashboard at an older version up to ``version``"""
+    changed = {}
+    for item in events:
+        if item['type'] == 'refresh':
+            changed = None
+            break
+        # Later events about the same expense win, except that a new
+        # expense stays new
+        if changed.get(item['id']) != 'added' or item['type'] == 'removed':
+            changed[item['id']] = item['type']
+
+    if changed is None or len(changed) > MAX_ROW_DELTAS:
+        return [_message('refresh', {
+            'summary_html': fragments.summary(version),
+            'balances_html': fragments.balances(version),
+            'expenses_html': fragments.expenses(version),
+        }, version)]
+
+    messages = []
+    rows = _render_rows([expense_id for expense_id, change in changed.items()
+                         if change != 'removed'])
+    for expense_id, change in changed.items():
+        if expense_id in rows:
+            messages.append(_message('expense', {
+                'id': expense_id, 'added': change == 'added', 'html': rows[expense_id]
+            }, version))
+        else:
+            messages.append(_message('expense-removed', {'id': expense_id}, version))
+    messages.append(_message('balances', {
+        'summary_html': fragments.summary(version),
+        'balances_html': fragments.balances(version),
+    }, version))
+    return messages
+
+
+def stream(group_id, since, fragments):
+    """Yield server-sent events for the current user's view of a group.
+
+    ``since`` is the group's data version the page was rendered at (or the
+    id of the last event received); ``fragments`` renders the group's
+    dashboard pieces for a version. Ends after ``LIVE_STREAM_SECONDS`` so that workers are handed
+    back regularly; the browser reconnects by itself.
+    """
+    config = current_app.config
+    broker = current_app.extensions['live_updates']
+    subscription = broker.subscribe(group_id)
+    try:
+        # Subscribed first, so nothing committed after this read is missed
+        version = current_data_version(group_id)
+        yield f'retry: {RETRY_MS}\nid: {version}\n\n'
+        if since != str(version):
+            yield from _deltas([_refresh(group_id)], version, fragments)
+        # Hand the connection back while idle
+        db.session.remove()
+
+        deadline = time.monotonic() + config['LIVE_STREAM_SECONDS']
+        while time.monotonic() < deadline:
+            events = subscription.get(timeout=config['LIVE_HEARTBEAT_SECONDS'])
+            if subscription.overflowed:
+                subscription.overflowed = False
+                events = [_refresh(group_id)]
+            if not events:
+                # Comment line; keeps proxies from closing an idle stream
+                yield ': keep-alive\n\n'
+                continue
+            version = current_data_version(group_id)
+            yield from _deltas(events, version, fragments)
+            db.session.remove()
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def init_app(app):
+    app.extensions['live_updates'] = Broker(app)
+    if not event.contains(RoutingSession, 'before_commit', _notify):
+        event.listen(RoutingSession, 'before_commit', _notify)
+        event.listen(RoutingSession, 'after_commit', _dispatch)
+        event.listen(RoutingSession, 'after_rollback', _discard)
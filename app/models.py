@@ -1,7 +1,7 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from decimal import Decimal, ROUND_HALF_UP
 from flask_login import UserMixin
-from app import db
+from app import db, passwords
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -13,21 +13,273 @@ class User(UserMixin, db.Model):
     expenses = db.relationship('Expense', backref='user', lazy='dynamic')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Check ``password``, upgrading a hash made with outdated parameters.
+        
+        The caller commits. Raises ``PasswordHasherBusy`` under overload.
+        """
+        if not passwords.verify_password(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
     def __repr__(self):
         return f'<User {self.email}>'
 
+class Group(db.Model):
+    """A household sharing expenses, e.g. one villa.
+
+    Expenses, balances, settlements and reports all belong to one group, and
+    members only ever see the groups they belong to.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    members = db.relationship('User', secondary='group_membership', backref='groups',
+                              order_by='User.full_name')
+    
+    def __repr__(self):
+        return f'<Group {self.id} {self.name!r}>'
+
+class GroupMembership(db.Model):
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    # Looked up from the user's side on every principal load
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, index=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<GroupMembership user {self.user_id} in group {self.group_id}>'
+
+# What :func:`expense_json` returns by default; the API and searches use it
+EXPENSE_JSON_FIELDS = ('id', 'group_id', 'date_entered', 'amount_eur', 'note', 'status',
+                       'user_id', 'user_name', 'version')
+
+def expense_json(record, fields=EXPENSE_JSON_FIELDS):
+    """JSON-ready copy of an expense's ``fields``.
+
+    The one expense serializer. ``record`` maps field names to values: a
+    query row's ``_mapping``, a dict, or :meth:`Expense.to_dict`'s values.
+    """
+    values = {name: record[name] for name in fields}
+    if 'date_entered' in values:
+        values['date_entered'] = values['date_entered'].isoformat()
+    if 'amount_eur' in values:
+        # Keep amounts exact; JSON numbers would go through float
+        values['amount_eur'] = str(Decimal(values['amount_eur']).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP))
+    return values
+
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date_entered = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    date_entered = db.Column(db.DateTime, default=datetime.utcnow)
     amount_eur = db.Column(db.Numeric(10, 2), nullable=False)
     note = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), default='unsettled')
+    # Bumped on every change; ORM updates and deletes of a row that changed
+    # since it was read raise StaleDataError instead of overwriting it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    # Every query is scoped to one group, so every index leads with it: a
+    # large household's rows are never read for another's pages
+    __table_args__ = (
+        # Date-range reports and the monthly rollup refresh filter on these
+        db.Index('ix_expense_group_date_user_status', 'group_id', 'date_entered', 'user_id',
+                 'status'),
+        # The listing order; newest-first pages are a backward range scan
+        # that stops at the page size, with no sort
+        db.Index('ix_expense_group_listing', 'group_id', 'date_entered', 'id'),
+        # One member's expenses, optionally by status (filters, API, export)
+        db.Index('ix_expense_group_user_status', 'group_id', 'user_id', 'status'),
+        # Settle-all walks and totals only the open expenses, a small slice
+        # of the history; PostgreSQL answers the totals from the index alone
+        db.Index('ix_expense_group_unsettled', 'group_id', 'id',
+                 postgresql_include=['amount_eur'],
+                 postgresql_where=db.text("status = 'unsettled'"),
+                 sqlite_where=db.text("status = 'unsettled'")),
+    )
+    __mapper_args__ = {'version_id_col': version}
+    
+    @property
+    def user_name(self):
+        return self.user.full_name
+    
+    def to_dict(self, fields=EXPENSE_JSON_FIELDS):
+        """JSON-ready copy of ``fields``, see :func:`expense_json`"""
+        return expense_json({name: getattr(self, name) for name in fields}, fields)
     
     def __repr__(self):
-        return f'<Expense {self.amount_eur} EUR by user {self.user_id}>' 
\ No newline at end of file
+        return f'<Expense {self.amount_eur} EUR by user {self.user_id}>'
+
+class ExpenseEvent(db.Model):
+    """Append-only history of expense changes, written by ``app.audit``"""
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: events outlive the expenses they describe
+    expense_id = db.Column(db.Integer, nullable=False, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    # The expense's fields before and after; None when created / deleted
+    before = db.Column(db.JSON)
+    after = db.Column(db.JSON)
+    
+    __table_args__ = (
+        # Replays read one group's events since a point in time
+        db.Index('ix_expense_event_group_occurred', 'group_id', 'occurred_at'),
+    )
+    
+    def __repr__(self):
+        return f'<ExpenseEvent {self.action} expense {self.expense_id}>'
+
+class ApiToken(db.Model):
+    """Bearer token for the JSON API; only a SHA-256 of the token is stored"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # The group the token reads and writes
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ApiToken {self.id} {self.name!r} for user {self.user_id}>'
+
+class UserBalance(db.Model):
+    """Running expense totals per member of a group.
+
+    Maintained incrementally by ``app.ledger`` in the same transaction as the
+    expense change, so balances can be read without scanning ``expense``.
+    """
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_paid = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    unsettled_total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UserBalance group {self.group_id} user {self.user_id}: {self.total_paid} EUR>'
+
+class MonthlyRollup(db.Model):
+    """Expense totals per group, calendar month (UTC), user and status.
+
+    Maintained incrementally by ``app.rollups`` alongside every expense
+    change, so reports read a few rows per month instead of ``expense``.
+    """
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MonthlyRollup {self.month:%Y-%m} user {self.user_id} {self.status}: {self.total} EUR>'
+
+class SettlementBatch(db.Model):
+    """One run of "settle all", processed in chunks by ``app.settlement``"""
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    started_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    # Only expenses that existed when the batch started are settled
+    max_expense_id = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    settled_count = db.Column(db.Integer, nullable=False, default=0)
+    settled_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    error = db.Column(db.Text)
+    
+    def to_dict(self):
+        percent = 100 if not self.total_count else \
+            min(100, round(100 * self.settled_count / self.total_count))
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total_count': self.total_count,
+            'settled_count': self.settled_count,
+            'total_amount': str(self.total_amount),
+            'settled_amount': str(self.settled_amount),
+            'percent': percent,
+            'error': self.error,
+        }
+    
+    def __repr__(self):
+        return f'<SettlementBatch {self.id} {self.status}>'
+
+class Settlement(db.Model):
+    """A closed settlement period.
+
+    Holds a frozen snapshot of every member's balance for the period and the
+    transfers that settle it, so past periods are read without touching
+    ``expense``. The current period runs from the group's latest settlement
+    onwards.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    closed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    closed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    batch_id = db.Column(db.Integer, db.ForeignKey('settlement_batch.id'))
+    # When the period began: the previous settlement's closed_at, if any
+    period_start = db.Column(db.DateTime)
+    total_expenses = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    member_count = db.Column(db.Integer, nullable=False, default=0)
+    cost_per_person = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    shares = db.relationship('SettlementShare', backref='settlement', lazy='dynamic',
+                             order_by='SettlementShare.paid.desc()')
+    transfers = db.relationship('SettlementTransfer', backref='settlement', lazy='dynamic',
+                                order_by='SettlementTransfer.id')
+    
+    def __repr__(self):
+        return f'<Settlement {self.id} closed {self.closed_at}>'
+
+class SettlementShare(db.Model):
+    """One member's frozen balance for a settlement period.
+
+    ``cumulative_paid`` and ``cumulative_count`` are the member's all-time
+    ledger totals when the period closed; live balances subtract them from
+    the ledger to get the current period.
+    """
+    settlement_id = db.Column(db.Integer, db.ForeignKey('settlement.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    paid = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    share = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    net = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    cumulative_paid = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    cumulative_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SettlementShare {self.settlement_id} user {self.user_id}: {self.net} EUR>'
+
+class SettlementTransfer(db.Model):
+    """A payment from one member to another that settles a period"""
+    id = db.Column(db.Integer, primary_key=True)
+    settlement_id = db.Column(db.Integer, db.ForeignKey('settlement.id'), nullable=False, index=True)
+    from_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    from_name = db.Column(db.String(100), nullable=False)
+    to_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    to_name = db.Column(db.String(100), nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    
+    def __repr__(self):
+        return f'<SettlementTransfer {self.from_user_id} -> {self.to_user_id}: {self.amount} EUR>'
+
+class DataVersion(db.Model):
+    """Per-group counter bumped by every expense write in the group.
+
+    Rendered fragments and ETags are keyed on it, so one cheap read tells a
+    view whether anything it shows could have changed. A group's row is
+    created with the group.
+    """
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
\ No newline at end of file
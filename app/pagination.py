@@ -0,0 +1,66 @@
+"""Keyset (cursor) pagination for the expense listing.
+
+Expenses are listed newest first, ordered by ``(date_entered, id)``. Instead
+of OFFSET paging, every page remembers the position of its last row and the
+next page continues strictly after it, so fetching page N costs the same as
+fetching page 1 regardless of how much history exists.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from app.models import Expense
+
+
+def encode_cursor(expense):
+    """Return an opaque cursor pointing just after ``expense``"""
+    raw = f'{expense.date_entered.isoformat()}|{expense.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into a ``(date_entered, id)`` tuple.
+
+    Raises ``ValueError`` if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date_part, id_part = raw.split('|')
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+def expense_page(group_id, cursor=None, per_page=None, query=None):
+    """Fetch one page of a group's expenses, newest first.
+
+    Returns a ``(expenses, next_cursor)`` tuple; ``next_cursor`` is ``None``
+    on the last page.
+    """
+    if per_page is None:
+        per_page = current_app.config['EXPENSES_PER_PAGE']
+    if query is None:
+        query = Expense.query
+
+    # Load each row's author in the same statement; the templates show
+    # expense.user.full_name for every row
+    query = query.options(joinedload(Expense.user)).filter(
+        Expense.group_id == group_id
+    ).order_by(Expense.date_entered.desc(), Expense.id.desc())
+    if cursor:
+        query = query.filter(
+            tuple_(Expense.date_entered, Expense.id) < decode_cursor(cursor)
+        )
+
+    # Fetch one extra row to find out whether another page exists
+    expenses = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(expenses) > per_page:
+        expenses = expenses[:per_page]
+        next_cursor = encode_cursor(expenses[-1])
+    return expenses, next_cursor
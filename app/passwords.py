@@ -0,0 +1,85 @@
+"""Password hashing with configurable cost, run in a bounded pool.
+
+``PASSWORD_HASH_METHOD`` is a werkzeug method string with its parameters
+(``scrypt:32768:8:1``, ``pbkdf2:sha256:600000``, ...). Hashes stored with
+other parameters keep working and are replaced with the configured ones the
+next time their owner logs in, so lowering or raising the cost needs no
+migration.
+
+Every hash and verification runs in a per-process pool of
+``PASSWORD_HASH_WORKERS`` threads (hashlib's scrypt and pbkdf2 release the
+GIL, so they do run in parallel). A burst of logins queues for the pool
+instead of taking every core from the requests around it; a login that
+waits longer than ``PASSWORD_HASH_TIMEOUT`` gets :class:`PasswordHasherBusy`.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, generate_password_hash,
+                               check_password_hash)
+
+_pool_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password checks are queued to take another one now"""
+
+
+def _normalise(method):
+    """The parameters werkzeug records in the hash for ``method``"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        args = ['32768', '8', '1']
+    elif name == 'pbkdf2':
+        args = (args or ['sha256'])[:2]
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join([name, *args])
+
+
+def _pool():
+    # Created on first use, so each gunicorn worker gets its own threads
+    pool = current_app.extensions.get('password_hasher')
+    if pool is None:
+        with _pool_lock:
+            pool = current_app.extensions.get('password_hasher')
+            if pool is None:
+                pool = current_app.extensions['password_hasher'] = ThreadPoolExecutor(
+                    current_app.config['PASSWORD_HASH_WORKERS'],
+                    thread_name_prefix='password-hasher'
+                )
+    return pool
+
+
+def hash_password(password):
+    return _pool().submit(
+        generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD']
+    ).result()
+
+
+def hash_passwords(passwords):
+    """Hash several passwords in parallel; returns the hashes in order"""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    return list(_pool().map(lambda password: generate_password_hash(password, method),
+                            passwords))
+
+
+def verify_password(password_hash, password):
+    """Check ``password`` against ``password_hash``.
+
+    Raises :class:`PasswordHasherBusy` if the pool cannot get to it within
+    ``PASSWORD_HASH_TIMEOUT`` seconds.
+    """
+    future = _pool().submit(check_password_hash, password_hash, password)
+    try:
+        return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+    except TimeoutError:
+        future.cancel()
+        raise PasswordHasherBusy() from None
+
+
+def needs_rehash(password_hash):
+    """True if the hash was made with other than the configured parameters"""
+    method = password_hash.split('$', 1)[0]
+    return method != _normalise(current_app.config['PASSWORD_HASH_METHOD'])
@@ -0,0 +1,178 @@
+"""Monthly expense rollups for reporting.
+
+``monthly_rollup`` holds one row per (group, month, user, status) with the
+total and number of expenses in it. Every expense write calls :func:`record` with the
+change it makes, in the same transaction, so reports read a few hundred rows
+instead of scanning ``expense``. :func:`rebuild_rollups` recomputes the table
+from ``expense`` with one grouped query (``date_trunc`` on PostgreSQL).
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import Date, cast, delete, extract, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.filters import parse_status, parse_user_id
+from app.models import User, Expense, MonthlyRollup
+
+# Arguments read by ``monthly_report``
+REPORT_FILTERS = ('from', 'to', 'status', 'user_id')
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+class RollupChanges:
+    """Deltas to apply to the rollup, summed per (group, month, user, status)"""
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+
+    def add(self, group_id, date_entered, user_id, status, amount=0, count=0):
+        delta = self._deltas[(group_id, month_start(date_entered), user_id, status)]
+        delta[0] += amount
+        delta[1] += count
+        return self
+
+    def rows(self):
+        return [
+            {'group_id': group_id, 'month': month, 'user_id': user_id, 'status': status,
+             'total': amount, 'expense_count': count}
+            for (group_id, month, user_id, status), (amount, count) in self._deltas.items()
+            if amount or count
+        ]
+
+
+def record(changes):
+    """Apply a :class:`RollupChanges` in the current transaction.
+
+    Uses ``total = total + delta`` upserts so concurrent writers add up
+    instead of overwriting each other.
+    """
+    rows = changes.rows()
+    if not rows:
+        return
+
+    dialect_insert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(MonthlyRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['group_id', 'month', 'user_id', 'status'],
+            set_={'total': MonthlyRollup.total + stmt.excluded.total,
+                  'expense_count': MonthlyRollup.expense_count + stmt.excluded.expense_count}
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        result = db.session.execute(
+            update(MonthlyRollup)
+            .where(MonthlyRollup.group_id == row['group_id'],
+                   MonthlyRollup.month == row['month'],
+                   MonthlyRollup.user_id == row['user_id'],
+                   MonthlyRollup.status == row['status'])
+            .values(total=MonthlyRollup.total + row['total'],
+                    expense_count=MonthlyRollup.expense_count + row['expense_count'])
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.session.add(MonthlyRollup(**row))
+
+
+def _monthly_totals():
+    """Aggregate ``expense`` per (group, month, user, status), straight from the source rows"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        month = cast(func.date_trunc('month', Expense.date_entered), Date)
+        return db.session.query(
+            Expense.group_id, month, Expense.user_id, Expense.status,
+            func.sum(Expense.amount_eur), func.count(Expense.id)
+        ).group_by(Expense.group_id, month, Expense.user_id, Expense.status).all()
+
+    year = extract('year', Expense.date_entered)
+    month = extract('month', Expense.date_entered)
+    rows = db.session.query(
+        Expense.group_id, year, month, Expense.user_id, Expense.status,
+        func.sum(Expense.amount_eur), func.count(Expense.id)
+    ).group_by(Expense.group_id, year, month, Expense.user_id, Expense.status).all()
+    return [(group_id, date(int(year), int(month), 1), user_id, status, total, count)
+            for group_id, year, month, user_id, status, total, count in rows]
+
+
+def rebuild_rollups():
+    """Recompute the whole rollup table from ``expense``.
+
+    The caller commits. Returns the number of rollup rows written.
+    """
+    rows = [
+        {'group_id': group_id, 'month': month, 'user_id': user_id, 'status': status,
+         'total': Decimal(total), 'expense_count': count}
+        for group_id, month, user_id, status, total, count in _monthly_totals()
+    ]
+    db.session.execute(delete(MonthlyRollup))
+    if rows:
+        db.session.execute(insert(MonthlyRollup), rows)
+    return len(rows)
+
+
+@dataclass(frozen=True)
+class MonthlyReport:
+    rows: tuple      # (month, user_id, user_name, status, total, expense_count)
+    months: tuple    # oldest first
+    users: tuple     # (user_id, user_name), by name
+    totals: dict     # (month, user_id) -> total across the selected statuses
+
+    def month_total(self, month):
+        return sum((self.totals.get((month, user_id), Decimal('0.00'))
+                    for user_id, _ in self.users), Decimal('0.00'))
+
+
+def _parse_month(value, name):
+    try:
+        return month_start(datetime.strptime(value, '%Y-%m'))
+    except ValueError as e:
+        raise ValueError(f"'{name}' must be a month in YYYY-MM format") from e
+
+
+def monthly_report(group_id, args):
+    """Build a group's :class:`MonthlyReport` from the rollup table.
+
+    Supported arguments: ``from`` and ``to`` (inclusive months, YYYY-MM),
+    ``status`` and ``user_id``. Raises ``ValueError`` on invalid input.
+    """
+    criteria = [MonthlyRollup.group_id == group_id]
+    if args.get('from'):
+        criteria.append(MonthlyRollup.month >= _parse_month(args['from'], 'from'))
+    if args.get('to'):
+        criteria.append(MonthlyRollup.month <= _parse_month(args['to'], 'to'))
+    if args.get('status'):
+        criteria.append(MonthlyRollup.status == parse_status(args['status']))
+    if args.get('user_id'):
+        criteria.append(MonthlyRollup.user_id == parse_user_id(args['user_id']))
+
+    rows = db.session.query(
+        MonthlyRollup.month, MonthlyRollup.user_id, User.full_name, MonthlyRollup.status,
+        MonthlyRollup.total, MonthlyRollup.expense_count
+    ).join(
+        User, User.id == MonthlyRollup.user_id
+    ).filter(
+        MonthlyRollup.expense_count != 0, *criteria
+    ).order_by(MonthlyRollup.month, User.full_name, MonthlyRollup.status).all()
+
+    totals = defaultdict(lambda: Decimal('0.00'))
+    users = {}
+    for month, user_id, name, status, total, count in rows:
+        totals[(month, user_id)] += total
+        users[user_id] = name
+    return MonthlyReport(
+        rows=tuple(tuple(row) for row in rows),
+        months=tuple(sorted({row[0] for row in rows})),
+        users=tuple(sorted(users.items(), key=lambda user: user[1])),
+        totals=dict(totals)
+    )
@@ -1,11 +1,27 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, abort,
+                   make_response, Response, stream_with_context, session, jsonify, current_app)
 from flask_login import login_user, logout_user, login_required, current_user
 from functools import wraps
-from app import db
-from app.models import User, Expense
-from app.forms import LoginForm, ChangePasswordForm, ExpenseForm, EditExpenseForm
-from sqlalchemy import func
-from decimal import Decimal
+import io
+from app import db, live, services
+from app.models import User, Expense, GroupMembership
+from app.balances import compute_balances
+from app.instrumentation import query_budget
+from app.passwords import PasswordHasherBusy
+from app.routing import use_primary
+from app.forms import LoginForm, ChangePasswordForm, ExpenseForm, EditExpenseForm, ImportExpensesForm
+from app.pagination import expense_page
+from app.filters import expense_criteria, filter_args, EXPENSE_FILTERS, EXPENSE_STATUSES
+from app.export import export_rows, generate_csv, generate_ndjson
+from app.importer import import_expenses
+from app.search import search_expenses
+from app.rollups import monthly_report, REPORT_FILTERS
+from app.settlement import start_settle_all, active_batch
+from app.models import SettlementBatch, Settlement
+from app.fragments import (current_data_version, cached_fragment, viewer_scope,
+                           page_etag, is_not_modified, set_validators)
+from app.groups import current_group_id, select_group
+from markupsafe import Markup
 
 main = Blueprint('main', __name__)
 
@@ -18,6 +34,16 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def _expense_page_or_400():
+    try:
+        return expense_page(current_group_id(), request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+def _group_expense_or_404(expense_id):
+    """An expense of the current group; other groups' expenses don't exist here"""
+    return Expense.query.filter_by(id=expense_id, group_id=current_group_id()).first_or_404()
+
 @main.route('/')
 def index():
     return redirect(url_for('main.login'))
@@ -30,7 +56,15 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('Too many people are signing in right now. Please try again in a moment.', 'error')
+            return render_template('login.html', form=form), 503
+        if valid:
+            if db.session.is_modified(user):
+                # check_password upgraded the hash
+                db.session.commit()
             login_user(user, remember=True)
             if user.force_password_change:
                 return redirect(url_for('main.change_password'))
@@ -49,143 +83,299 @@ def change_password():
     
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        current_user.set_password(form.new_password.data)
-        current_user.force_password_change = False
+        # current_user is a cached principal; update the real row
+        user = db.session.get(User, current_user.id)
+        user.set_password(form.new_password.data)
+        user.force_password_change = False
         db.session.commit()
         flash('Your password has been changed successfully!', 'success')
         return redirect(url_for('main.dashboard'))
     
     return render_template('change_password.html', form=form)
 
+class DashboardFragments:
+    """A group's cached dashboard pieces, sharing one balance computation per version"""
+    
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self._balances = {}
+    
+    def _get_balances(self, version):
+        if version not in self._balances:
+            self._balances = {version: compute_balances(self.group_id)}
+        return self._balances[version]
+    
+    def summary(self, version):
+        return cached_fragment('summary', self.group_id, version, 'all', lambda: render_template(
+            '_summary_cards.html', balances=self._get_balances(version)))
+    
+    def balances(self, version):
+        return cached_fragment('balances', self.group_id, version, 'all', lambda: render_template(
+            '_balance_table.html', balances=self._get_balances(version)))
+    
+    def expenses(self, version, cursor=None):
+        def render():
+            try:
+                expenses, next_cursor = expense_page(self.group_id, cursor)
+            except ValueError:
+                abort(400)
+            return render_template('_expense_table.html',
+                                   expenses=expenses,
+                                   next_cursor=next_cursor)
+        if cursor:
+            # Deep pages (no-JS "load more") are rare; don't cache them
+            return Markup(render())
+        return cached_fragment('expenses', self.group_id, version, viewer_scope(), render)
+
+def _live_submit():
+    """True for a form posted by the dashboard script, which gets its update over /events"""
+    return request.headers.get('X-Live-Update') == '1'
+
 @main.route('/dashboard', methods=['GET', 'POST'])
 @login_required
+@query_budget(6)
 def dashboard():
+    group_id = current_group_id()
     form = ExpenseForm()
     if form.validate_on_submit():
-        expense = Expense(
-            amount_eur=form.amount_eur.data,
-            note=form.note.data,
-            user_id=current_user.id
-        )
-        db.session.add(expense)
+        services.add_expense(group_id, current_user.id, form.amount_eur.data, form.note.data)
         db.session.commit()
+        if _live_submit():
+            return '', 204
         flash('Expense added successfully!', 'success')
         return redirect(url_for('main.dashboard'))
     
-    # Get all expenses
-    expenses = Expense.query.order_by(Expense.date_entered.desc()).all()
-    
-    # Calculate totals
-    total_expenses = float(sum(expense.amount_eur for expense in expenses))
-    cost_per_person = total_expenses / 4 if total_expenses > 0 else 0
-    
-    # Calculate expenses by user
-    user_expenses = db.session.query(
-        User.full_name,
-        func.coalesce(func.sum(Expense.amount_eur), 0).label('total_paid'),
-        func.count(Expense.id).label('expense_count')
-    ).outerjoin(
-        Expense, User.id == Expense.user_id
-    ).group_by(
-        User.id, User.full_name
-    ).all()
+    # Everything below only changes when the data version does
+    version = current_data_version(group_id)
+    cursor = request.args.get('cursor')
+    etag = page_etag('dashboard', group_id, version)
+    if request.method == 'GET' and not cursor and is_not_modified(etag):
+        return set_validators(make_response('', 304), etag)
     
-    # Calculate balance for each user
-    user_balances = []
-    for user_name, total_paid, expense_count in user_expenses:
-        # Convert to float, handling Decimal and None
-        total_paid_float = float(total_paid) if total_paid else 0
-        balance = total_paid_float - cost_per_person
-        
-        user_balances.append({
-            'name': user_name,
-            'total_paid': total_paid_float,
-            'expense_count': expense_count or 0,
-            'balance': balance,
-            'owes': -balance if balance < 0 else 0,
-            'owed': balance if balance > 0 else 0
-        })
-    
-    # Sort by total paid (descending)
-    user_balances.sort(key=lambda x: x['total_paid'], reverse=True)
-    
-    return render_template('dashboard.html', 
-                         form=form, 
-                         expenses=expenses,
-                         total_expenses=total_expenses,
-                         cost_per_person=cost_per_person,
-                         user_balances=user_balances)
+    fragments = DashboardFragments(group_id)
+    
+    # Pages showing flash messages must not be revalidated later
+    cacheable = request.method == 'GET' and not cursor and '_flashes' not in session
+    response = make_response(render_template('dashboard.html',
+                                             form=form,
+                                             version=version,
+                                             live_updates=current_app.config['LIVE_UPDATES'],
+                                             summary_html=fragments.summary(version),
+                                             balances_html=fragments.balances(version),
+                                             expenses_html=fragments.expenses(version, cursor)))
+    if cacheable:
+        set_validators(response, etag)
+    return response
+
+@main.route('/events')
+@login_required
+@use_primary
+def events():
+    """Server-sent events that keep an open dashboard current."""
+    if not current_app.config['LIVE_UPDATES']:
+        abort(404)
+    group_id = current_group_id()
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    return Response(stream_with_context(live.stream(group_id, since,
+                                                    DashboardFragments(group_id))),
+                    mimetype='text/event-stream', headers={
+                        'Cache-Control': 'no-cache',
+                        # Don't let nginx-style proxies hold events back
+                        'X-Accel-Buffering': 'no'
+                    })
 
 @main.route('/admin')
 @login_required
 @admin_required
+@query_budget(4)
 def admin():
-    expenses = Expense.query.order_by(Expense.date_entered.desc()).all()
-    total_expenses = float(sum(expense.amount_eur for expense in expenses))
-    cost_per_person = total_expenses / 4 if total_expenses > 0 else 0
-    
-    # Calculate expenses by user
-    user_expenses = db.session.query(
-        User.full_name,
-        func.coalesce(func.sum(Expense.amount_eur), 0).label('total_paid'),
-        func.count(Expense.id).label('expense_count')
-    ).outerjoin(
-        Expense, User.id == Expense.user_id
-    ).group_by(
-        User.id, User.full_name
-    ).all()
-    
-    # Calculate balance for each user
-    user_balances = []
-    for user_name, total_paid, expense_count in user_expenses:
-        # Convert to float, handling Decimal and None
-        total_paid_float = float(total_paid) if total_paid else 0
-        balance = total_paid_float - cost_per_person
-        
-        user_balances.append({
-            'name': user_name,
-            'total_paid': total_paid_float,
-            'expense_count': expense_count or 0,
-            'balance': balance,
-            'owes': -balance if balance < 0 else 0,
-            'owed': balance if balance > 0 else 0
-        })
-    
-    # Sort by total paid (descending)
-    user_balances.sort(key=lambda x: x['total_paid'], reverse=True)
+    group_id = current_group_id()
+    expenses, next_cursor = _expense_page_or_400()
+    balances = compute_balances(group_id)
     
     return render_template('admin.html',
                          expenses=expenses,
-                         total_expenses=total_expenses,
-                         cost_per_person=cost_per_person,
-                         user_balances=user_balances)
+                         next_cursor=next_cursor,
+                         balances=balances,
+                         settle_batch=active_batch(group_id))
+
+@main.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_expenses_upload():
+    form = ImportExpensesForm()
+    report = None
+    if form.validate_on_submit():
+        stream = io.TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_expenses(stream, current_group_id(), default_user_id=current_user.id)
+        except UnicodeDecodeError:
+            db.session.rollback()
+            flash('The file must be UTF-8 encoded CSV.', 'error')
+        else:
+            db.session.commit()
+            flash(f'Imported {report.inserted} expense(s).', 'success')
+    
+    return render_template('import_expenses.html', form=form, report=report)
+
+@main.route('/expenses/rows')
+@login_required
+@query_budget(2)
+def expense_rows():
+    """Render the next page of expense table rows for "load more"."""
+    admin_view = request.args.get('view') == 'admin'
+    if admin_view and not current_user.is_admin:
+        abort(403)
+    
+    expenses, next_cursor = _expense_page_or_400()
+    response = make_response(render_template('_expense_rows.html',
+                                             expenses=expenses,
+                                             admin_view=admin_view))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@main.route('/export/expenses.<any(csv, ndjson):fmt>')
+@login_required
+def export_expenses(fmt):
+    """Stream the expense history, optionally filtered by date, status and user."""
+    try:
+        criteria = expense_criteria(current_group_id(), request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    
+    if fmt == 'csv':
+        body, mimetype = generate_csv(export_rows(criteria)), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(export_rows(criteria)), 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=expenses.{fmt}'
+    })
+
+@main.route('/search', defaults={'fmt': 'html'})
+@main.route('/search.<any(json):fmt>')
+@login_required
+@query_budget(4)
+def search(fmt):
+    """Ranked search over expense notes, with the export filters."""
+    group_id = current_group_id()
+    try:
+        criteria = expense_criteria(group_id, request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    page = max(request.args.get('page', 1, type=int), 1)
+    q = request.args.get('q', '').strip()
+    
+    expenses, has_next = search_expenses(q, criteria, page=page)
+    if fmt == 'json':
+        return jsonify(results=[expense.to_dict() for expense in expenses],
+                       page=page, next_page=page + 1 if has_next else None)
+    
+    users = db.session.query(User.id, User.full_name).join(
+        GroupMembership, GroupMembership.user_id == User.id
+    ).filter(GroupMembership.group_id == group_id).order_by(User.full_name).all()
+    filters = filter_args(request.args, ('q',) + EXPENSE_FILTERS)
+    return render_template('search.html',
+                           expenses=expenses,
+                           users=users,
+                           statuses=EXPENSE_STATUSES,
+                           filters=filters,
+                           page=page,
+                           has_next=has_next)
+
+@main.route('/reports', defaults={'fmt': 'html'})
+@main.route('/reports.<any(json):fmt>')
+@login_required
+@query_budget(2)
+def reports(fmt):
+    """Monthly spend per user, read from the rollup table."""
+    try:
+        report = monthly_report(current_group_id(), request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    
+    if fmt == 'json':
+        return jsonify(months=[
+            {'month': month.strftime('%Y-%m'), 'user_id': user_id, 'user_name': name,
+             'status': status, 'total': str(total), 'expense_count': count}
+            for month, user_id, name, status, total, count in report.rows
+        ])
+    return render_template('reports.html', report=report, statuses=EXPENSE_STATUSES,
+                           filters=filter_args(request.args, REPORT_FILTERS))
 
 @main.route('/settle-expenses', methods=['POST'])
 @login_required
 @admin_required
 def settle_expenses():
-    Expense.query.filter_by(status='unsettled').update({'status': 'settled'})
-    db.session.commit()
-    flash('All expenses have been settled!', 'success')
+    batch, started = start_settle_all(current_group_id(), current_user.id)
+    if not started:
+        flash('A settlement is already in progress.', 'info')
+    elif batch.status == 'done':
+        flash(f'{batch.settled_count} expense(s) have been settled!', 'success')
+    elif batch.status == 'failed':
+        flash('Settling expenses failed. Please try again.', 'error')
+    else:
+        flash(f'Settling {batch.total_count} expense(s) in the background.', 'info')
     return redirect(url_for('main.admin'))
 
+@main.route('/settle-expenses/<int:batch_id>')
+@login_required
+@admin_required
+@use_primary
+def settle_expenses_status(batch_id):
+    """Progress of a settle-all batch, polled by the admin page."""
+    batch = SettlementBatch.query.filter_by(id=batch_id,
+                                            group_id=current_group_id()).first_or_404()
+    return jsonify(batch.to_dict())
+
+@main.route('/settlements')
+@login_required
+@query_budget(2)
+def settlements():
+    """Closed settlement periods, newest first."""
+    periods = Settlement.query.filter_by(group_id=current_group_id()).order_by(
+        Settlement.id.desc()
+    ).all()
+    return render_template('settlements.html', settlements=periods)
+
+@main.route('/settlements/<int:settlement_id>')
+@login_required
+@query_budget(4)
+def settlement_detail(settlement_id):
+    """A closed period, straight from its snapshot."""
+    settlement = Settlement.query.filter_by(id=settlement_id,
+                                            group_id=current_group_id()).first_or_404()
+    return render_template('settlement.html',
+                           settlement=settlement,
+                           shares=settlement.shares.all(),
+                           transfers=settlement.transfers.all())
+
 @main.route('/settle-expense/<int:expense_id>', methods=['POST'])
 @login_required
 @admin_required
 def settle_individual_expense(expense_id):
-    expense = Expense.query.get_or_404(expense_id)
-    if expense.status == 'unsettled':
-        expense.status = 'settled'
+    expense = _group_expense_or_404(expense_id)
+    amount_eur = expense.amount_eur
+    try:
+        settled = services.settle_expense(expense,
+                                          expected_version=request.form.get('version', type=int))
         db.session.commit()
-        flash(f'Expense of €{expense.amount_eur} has been settled!', 'success')
+    except services.ExpenseConflict:
+        db.session.rollback()
+        flash('Someone else changed this expense in the meantime, so it was not settled. '
+              'Please check it and try again.', 'error')
+        return redirect(request.referrer or url_for('main.admin'))
+    if settled:
+        flash(f'Expense of €{amount_eur} has been settled!', 'success')
     else:
         flash('This expense is already settled.', 'info')
     return redirect(request.referrer or url_for('main.admin'))
 
 @main.route('/edit-expense/<int:expense_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(7)
 def edit_expense(expense_id):
-    expense = Expense.query.get_or_404(expense_id)
+    expense = _group_expense_or_404(expense_id)
     
     # Check if user can edit this expense (only their own expenses)
     if expense.user_id != current_user.id and not current_user.is_admin:
@@ -195,15 +385,28 @@ def edit_expense(expense_id):
     form = EditExpenseForm()
     
     if form.validate_on_submit():
-        expense.amount_eur = form.amount_eur.data
-        expense.note = form.note.data
-        db.session.commit()
+        try:
+            services.update_expense(expense, form.amount_eur.data, form.note.data,
+                                    expected_version=form.version.data)
+            db.session.commit()
+        except services.ExpenseConflict:
+            db.session.rollback()
+            expense = db.session.get(Expense, expense_id)
+            if expense is None:
+                flash('This expense was deleted by someone else.', 'error')
+                return redirect(url_for('main.dashboard'))
+            # Keep what the user typed; saving again overwrites the current values
+            form.version.data = expense.version
+            form.version.raw_data = None
+            return render_template('edit_expense.html', form=form, expense=expense,
+                                   conflict=True), 409
         flash('Expense updated successfully!', 'success')
         return redirect(url_for('main.dashboard'))
     
     # Pre-populate form with existing data
     if request.method == 'GET':
         form.expense_id.data = expense.id
+        form.version.data = expense.version
         form.amount_eur.data = expense.amount_eur
         form.note.data = expense.note
     
@@ -212,18 +415,42 @@ def edit_expense(expense_id):
 @main.route('/delete-expense/<int:expense_id>', methods=['POST'])
 @login_required
 def delete_expense(expense_id):
-    expense = Expense.query.get_or_404(expense_id)
+    expense = _group_expense_or_404(expense_id)
     
     # Check if user can delete this expense (only their own expenses or admin)
     if expense.user_id != current_user.id and not current_user.is_admin:
         flash('You can only delete your own expenses.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    db.session.delete(expense)
-    db.session.commit()
+    try:
+        services.delete_expense(expense, expected_version=request.form.get('version', type=int))
+        db.session.commit()
+    except services.ExpenseConflict:
+        db.session.rollback()
+        if _live_submit():
+            return '', 409
+        flash('Someone else changed this expense in the meantime, so it was not deleted. '
+              'Please check it and try again.', 'error')
+        return redirect(request.referrer or url_for('main.dashboard'))
+    if _live_submit():
+        return '', 204
     flash('Expense deleted successfully!', 'success')
     return redirect(request.referrer or url_for('main.dashboard'))
 
+@main.app_context_processor
+def inject_current_group():
+    if current_user.is_authenticated and current_user.group_ids:
+        return {'current_group_id': current_group_id()}
+    return {}
+
+@main.route('/groups/<int:group_id>/select', methods=['POST'])
+@login_required
+def select_household(group_id):
+    """Switch to another household the user is a member of."""
+    if not select_group(group_id):
+        flash('You are not a member of that household.', 'error')
+    return redirect(url_for('main.dashboard'))
+
 @main.route('/logout')
 @login_required
 def logout():
@@ -0,0 +1,99 @@
+"""Read-replica routing.
+
+With ``DATABASE_REPLICA_URLS`` set, every replica becomes a Flask-SQLAlchemy
+bind (``replica0``, ``replica1``, ...) and :class:`RoutingSession` decides per
+statement where it runs:
+
+* ``SELECT`` statements in a ``GET``/``HEAD`` request go to one replica,
+  picked once per request;
+* everything else - writes, flushes, ``SELECT ... FOR UPDATE``, CLI commands,
+  background threads - goes to the primary.
+
+Once a request writes, the rest of it reads from the primary, and so do the
+same user's requests for the next ``REPLICA_STICKY_SECONDS``, so people always
+see their own changes despite replication lag. Views that must never read
+stale data can opt out with :func:`use_primary`, single queries with
+``.execution_options(use_primary=True)``.
+"""
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, UpdateBase
+
+_STICKY_KEY = '_db_primary_until'
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if _is_write(self, clause):
+                g.db_wrote = True
+            elif (isinstance(clause, Select) and _reads_from_replica()
+                  and not clause.get_execution_options().get('use_primary')):
+                replica = _request_replica(self._db.engines)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_write(session, clause):
+    return (session._flushing
+            or isinstance(clause, UpdateBase)
+            or (isinstance(clause, Select) and clause._for_update_arg is not None))
+
+
+def _reads_from_replica():
+    return (request.method in ('GET', 'HEAD')
+            and not g.get('db_wrote')
+            and not g.get('db_use_primary')
+            and session.get(_STICKY_KEY, 0) < time.time())
+
+
+def _request_replica(engines):
+    if 'db_replica' not in g:
+        replicas = [engine for key, engine in engines.items()
+                    if key is not None and key.startswith('replica')]
+        g.db_replica = random.choice(replicas) if replicas else None
+    return g.db_replica
+
+
+def use_primary(f):
+    """Always read from the primary in this view"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_use_primary = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _stick_to_primary(response):
+    window = current_app.config['REPLICA_STICKY_SECONDS']
+    if g.get('db_wrote') and window:
+        session[_STICKY_KEY] = time.time() + window
+    return response
+
+
+def configure(app):
+    """Turn the replica and pool settings into Flask-SQLAlchemy engine config.
+
+    Must run before ``db.init_app(app)``.
+    """
+    engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    engine_options.update(app.config['DATABASE_POOL'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    urls = app.config['DATABASE_REPLICA_URLS']
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.split(',') if url.strip()]
+    for i, url in enumerate(urls):
+        binds[f'replica{i}'] = {'url': url, **app.config['DATABASE_REPLICA_POOL']}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    if any(key.startswith('replica') for key in app.config['SQLALCHEMY_BINDS']):
+        app.after_request(_stick_to_primary)
@@ -0,0 +1,183 @@
+"""Schema changes that ``db.create_all()`` cannot make.
+
+``create_all`` only creates missing tables. Database-specific objects (search
+columns, virtual tables, triggers, special indexes) and changes to existing
+tables are applied here by :func:`upgrade_schema`. Every step is idempotent,
+so ``init_db.py`` runs it on each deploy right after ``create_all``.
+"""
+from datetime import datetime
+
+from sqlalchemy import insert, inspect, literal, select, text
+
+from app import db
+from app.groups import DEFAULT_GROUP_NAME
+from app.models import (User, Group, GroupMembership, UserBalance, MonthlyRollup,
+                        DataVersion)
+
+# Tables whose rows belong to one group
+GROUP_SCOPED_TABLES = ('expense', 'expense_event', 'api_token', 'settlement_batch', 'settlement')
+
+
+def _expense_search(connection):
+    """Full-text index over ``expense.note``.
+
+    PostgreSQL gets a generated ``tsvector`` column with a GIN index, SQLite
+    an external-content FTS5 table kept in sync by triggers. Either way every
+    write path (forms, bulk import, settle-all) keeps the index current.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text(
+            "ALTER TABLE expense ADD COLUMN IF NOT EXISTS note_search tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', note)) STORED"
+        ))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_expense_note_search ON expense USING GIN (note_search)'
+        ))
+    elif dialect == 'sqlite':
+        has_trigger = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'expense_fts_insert'"
+        )).first()
+        if has_trigger:
+            return
+        # Triggers vanish when ``expense`` is dropped and recreated, so a
+        # missing trigger means the index has to be rebuilt from scratch
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS expense_fts USING fts5("
+            "note, content='expense', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        connection.execute(text(
+            'CREATE TRIGGER expense_fts_insert AFTER INSERT ON expense BEGIN '
+            'INSERT INTO expense_fts (rowid, note) VALUES (new.id, new.note); END'
+        ))
+        connection.execute(text(
+            'CREATE TRIGGER expense_fts_delete AFTER DELETE ON expense BEGIN '
+            "INSERT INTO expense_fts (expense_fts, rowid, note) VALUES ('delete', old.id, old.note); END"
+        ))
+        connection.execute(text(
+            'CREATE TRIGGER expense_fts_update AFTER UPDATE OF note ON expense BEGIN '
+            "INSERT INTO expense_fts (expense_fts, rowid, note) VALUES ('delete', old.id, old.note); "
+            'INSERT INTO expense_fts (rowid, note) VALUES (new.id, new.note); END'
+        ))
+        connection.execute(text("INSERT INTO expense_fts (expense_fts) VALUES ('rebuild')"))
+
+
+def _append_only_audit_log(connection):
+    """Reject ``UPDATE`` and ``DELETE`` on ``expense_event``"""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text(
+            'CREATE OR REPLACE FUNCTION expense_event_append_only() RETURNS trigger AS $$ '
+            "BEGIN RAISE EXCEPTION 'expense_event is append-only'; END; $$ LANGUAGE plpgsql"
+        ))
+        connection.execute(text(
+            'DROP TRIGGER IF EXISTS expense_event_append_only ON expense_event'
+        ))
+        connection.execute(text(
+            'CREATE TRIGGER expense_event_append_only BEFORE UPDATE OR DELETE ON expense_event '
+            'FOR EACH ROW EXECUTE FUNCTION expense_event_append_only()'
+        ))
+    elif dialect == 'sqlite':
+        for operation in ('UPDATE', 'DELETE'):
+            connection.execute(text(
+                f'CREATE TRIGGER IF NOT EXISTS expense_event_no_{operation.lower()} '
+                f'BEFORE {operation} ON expense_event BEGIN '
+                "SELECT RAISE(ABORT, 'expense_event is append-only'); END"
+            ))
+
+
+def _expense_version(connection):
+    """Optimistic-locking version column on ``expense``"""
+    columns = {column['name'] for column in inspect(connection).get_columns('expense')}
+    if 'version' not in columns:
+        connection.execute(text(
+            'ALTER TABLE expense ADD COLUMN version INTEGER NOT NULL DEFAULT 1'
+        ))
+
+
+def _columns(connection, table):
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def _expense_groups(connection):
+    """Move a single-household database into its first group.
+
+    Every user joins the new group, and existing rows are assigned to it
+    through the new column's default. Tables that ``create_all`` has just
+    created already have the column.
+    """
+    missing = [table for table in GROUP_SCOPED_TABLES
+               if 'group_id' not in _columns(connection, table)]
+    if not missing:
+        return
+    now = datetime.utcnow()
+    group_id = connection.execute(
+        insert(Group).values(name=DEFAULT_GROUP_NAME, created_at=now)
+    ).inserted_primary_key[0]
+    connection.execute(insert(GroupMembership).from_select(
+        ['group_id', 'user_id', 'joined_at'],
+        select(literal(group_id), User.id, literal(now))
+    ))
+    postgres = connection.dialect.name == 'postgresql'
+    for table in missing:
+        # SQLite cannot add a foreign key column with a default
+        reference = ' REFERENCES "group" (id)' if postgres else ''
+        connection.execute(text(
+            f'ALTER TABLE {table} ADD COLUMN group_id INTEGER NOT NULL DEFAULT {int(group_id)}'
+            f'{reference}'
+        ))
+        if postgres:
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN group_id DROP DEFAULT'))
+
+
+def _group_derived_tables(connection):
+    """Recreate per-user derived tables keyed by group.
+
+    They only hold data recomputed from ``expense``; ``init_db.py`` refills
+    them right after the upgrade. Every group gets its data version row.
+    """
+    for model in (UserBalance, MonthlyRollup, DataVersion):
+        if 'group_id' not in _columns(connection, model.__tablename__):
+            model.__table__.drop(connection)
+            model.__table__.create(connection)
+    connection.execute(insert(DataVersion).from_select(
+        ['group_id', 'version'],
+        select(Group.id, literal(0)).where(~select(DataVersion.group_id).where(
+            DataVersion.group_id == Group.id
+        ).exists())
+    ))
+
+
+def _redundant_indexes(connection):
+    """Indexes made obsolete by wider ones with the same leading columns"""
+    # ``date_entered`` alone, then the single-household indexes; all are
+    # superseded by ones led by ``group_id``
+    for name in ('ix_expense_date_entered', 'ix_expense_date_user_status', 'ix_expense_listing',
+                 'ix_expense_user_status', 'ix_expense_unsettled', 'ix_expense_event_occurred_at'):
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def _missing_indexes(connection):
+    """Indexes declared on the models after their tables were created"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+UPGRADE_STEPS = (
+    _expense_search,
+    _append_only_audit_log,
+    _expense_version,
+    _expense_groups,
+    _group_derived_tables,
+    _redundant_indexes,
+    _missing_indexes,
+)
+
+
+def upgrade_schema():
+    """Apply every upgrade step in one transaction"""
+    with db.engine.begin() as connection:
+        for step in UPGRADE_STEPS:
+            step(connection)
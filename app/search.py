@@ -0,0 +1,93 @@
+"""Ranked full-text search over expense notes.
+
+Uses the index created by :mod:`app.schema`: the ``note_search`` tsvector
+column on PostgreSQL, the ``expense_fts`` FTS5 table on SQLite. Every word in
+the query must match (as a prefix, so ``plumb`` finds "plumber"); results are
+ordered by relevance, then newest first. Databases without either index fall
+back to unranked ``ILIKE`` matching.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import Expense
+
+# Longest query honoured; anything after this many words is ignored
+MAX_TERMS = 10
+
+_TERM = re.compile(r'[^\W_]+')
+
+_expense_fts = table('expense_fts', column('rowid'))
+
+
+def search_terms(q):
+    return _TERM.findall((q or '').lower())[:MAX_TERMS]
+
+
+def _detect_backend():
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        found = db.session.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'expense' AND column_name = 'note_search'"
+        )).first()
+        return 'postgresql' if found else 'like'
+    if dialect == 'sqlite':
+        found = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'expense_fts'"
+        )).first()
+        return 'sqlite' if found else 'like'
+    return 'like'
+
+
+def search_backend():
+    """Which index backs search on this app's database, detected once"""
+    backend = current_app.extensions.get('expense_search')
+    if backend is None:
+        backend = current_app.extensions['expense_search'] = _detect_backend()
+    return backend
+
+
+def _match(query, terms):
+    backend = search_backend()
+    if backend == 'postgresql':
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        document = literal_column('expense.note_search')
+        return query.filter(document.op('@@')(tsquery)).order_by(
+            func.ts_rank(document, tsquery).desc(), Expense.id.desc()
+        )
+    if backend == 'sqlite':
+        fts = literal_column('expense_fts')
+        return query.join(
+            _expense_fts, _expense_fts.c.rowid == Expense.id
+        ).filter(
+            fts.op('MATCH')(' '.join(f'"{term}"*' for term in terms))
+        ).order_by(func.bm25(fts), Expense.id.desc())
+
+    for term in terms:
+        query = query.filter(Expense.note.ilike(f'%{term}%'))
+    return query.order_by(Expense.date_entered.desc(), Expense.id.desc())
+
+
+def search_expenses(q, criteria=(), page=1, per_page=None):
+    """Return one page of expenses matching ``q`` and ``criteria``.
+
+    Returns ``(expenses, has_next)``. Without any search words this is a
+    plain filtered listing, newest first.
+    """
+    if per_page is None:
+        per_page = current_app.config['EXPENSES_PER_PAGE']
+
+    query = Expense.query.options(joinedload(Expense.user)).filter(*criteria)
+    terms = search_terms(q)
+    if terms:
+        query = _match(query, terms)
+    else:
+        query = query.order_by(Expense.date_entered.desc(), Expense.id.desc())
+
+    # Fetch one extra row to find out whether another page exists
+    expenses = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return expenses[:per_page], len(expenses) > per_page
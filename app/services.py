@@ -0,0 +1,141 @@
+"""Expense mutations shared by the views.
+
+Each function changes the expense table and everything derived from it (the
+expense's group's balance ledger, monthly rollups and data version) in the
+caller's transaction, and queues the matching audit event and live update; the caller
+commits.
+
+Changes to a single expense are checked against its ``version``: they raise
+:class:`ExpenseConflict` if the row changed since it was read, or since the
+``expected_version`` the user saw, instead of silently overwriting it.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import update
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import audit, db, ledger, live, rollups
+from app.fragments import bump_data_version
+from app.models import Expense
+
+
+class ExpenseConflict(Exception):
+    """The expense was changed or deleted by someone else in the meantime"""
+
+
+def _check_version(expense, expected_version):
+    if expected_version is not None and expected_version != expense.version:
+        raise ExpenseConflict()
+
+
+def _flush_checked():
+    """Write the pending row change now, so a conflict surfaces here"""
+    try:
+        db.session.flush()
+    except StaleDataError as e:
+        raise ExpenseConflict() from e
+
+
+def add_expense(group_id, user_id, amount_eur, note):
+    amount_eur = Decimal(amount_eur)
+    expense = Expense(group_id=group_id, date_entered=datetime.utcnow(),
+                      amount_eur=amount_eur, note=note, user_id=user_id, status='unsettled')
+    db.session.add(expense)
+    ledger.record(group_id, user_id, paid=amount_eur, count=1, unsettled=amount_eur)
+    rollups.record(rollups.RollupChanges().add(
+        group_id, expense.date_entered, user_id, 'unsettled', amount_eur, 1))
+    bump_data_version(group_id)
+    audit.record('created', expense, after=audit.snapshot(expense))
+    live.publish('added', expense)
+    return expense
+
+
+def update_expense(expense, amount_eur, note, expected_version=None):
+    _check_version(expense, expected_version)
+    before = audit.snapshot(expense)
+    amount_eur = Decimal(amount_eur)
+    delta = amount_eur - expense.amount_eur
+    expense.amount_eur = amount_eur
+    expense.note = note
+    _flush_checked()
+    if delta:
+        unsettled = delta if expense.status == 'unsettled' else 0
+        ledger.record(expense.group_id, expense.user_id, paid=delta, unsettled=unsettled)
+        rollups.record(rollups.RollupChanges().add(
+            expense.group_id, expense.date_entered, expense.user_id, expense.status, delta))
+    bump_data_version(expense.group_id)
+    audit.record('updated', expense, before, audit.snapshot(expense))
+    live.publish('changed', expense)
+    return expense
+
+
+def delete_expense(expense, expected_version=None):
+    _check_version(expense, expected_version)
+    before = audit.snapshot(expense)
+    unsettled = expense.amount_eur if expense.status == 'unsettled' else 0
+    db.session.delete(expense)
+    _flush_checked()
+    ledger.record(expense.group_id, expense.user_id, paid=-expense.amount_eur, count=-1,
+                  unsettled=-unsettled)
+    rollups.record(rollups.RollupChanges().add(
+        expense.group_id, expense.date_entered, expense.user_id, expense.status,
+        -expense.amount_eur, -1))
+    bump_data_version(expense.group_id)
+    audit.record('deleted', expense, before=before)
+    live.publish('removed', expense)
+
+
+def settle_expense(expense, expected_version=None):
+    """Mark one expense settled. Returns False if it already was."""
+    if expense.status != 'unsettled':
+        return False
+    _check_version(expense, expected_version)
+    before = audit.snapshot(expense)
+    expense.status = 'settled'
+    _flush_checked()
+    group_id = expense.group_id
+    ledger.record(group_id, expense.user_id, unsettled=-expense.amount_eur)
+    rollups.record(rollups.RollupChanges()
+                   .add(group_id, expense.date_entered, expense.user_id, 'unsettled',
+                        -expense.amount_eur, -1)
+                   .add(group_id, expense.date_entered, expense.user_id, 'settled',
+                        expense.amount_eur, 1))
+    bump_data_version(group_id)
+    audit.record('settled', expense, before, audit.snapshot(expense))
+    live.publish('changed', expense)
+    return True
+
+
+def settle_expense_ids(group_id, expense_ids):
+    """Settle the given expenses of a group if still unsettled.
+
+    Returns ``(count, amount)`` for the rows actually settled.
+    """
+    rows = db.session.execute(
+        update(Expense)
+        .where(Expense.group_id == group_id, Expense.id.in_(expense_ids),
+               Expense.status == 'unsettled')
+        .values(status='settled', version=Expense.version + 1)
+        .returning(Expense.id, Expense.user_id, Expense.amount_eur, Expense.date_entered,
+                   Expense.note)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    settled = defaultdict(Decimal)
+    changes = rollups.RollupChanges()
+    for expense_id, user_id, amount_eur, date_entered, note in rows:
+        after = audit.snapshot({'group_id': group_id, 'date_entered': date_entered,
+                                'amount_eur': amount_eur, 'note': note, 'status': 'settled',
+                                'user_id': user_id})
+        audit.record('settled', expense_id, dict(after, status='unsettled'), after)
+        settled[user_id] += amount_eur
+        changes.add(group_id, date_entered, user_id, 'unsettled', -amount_eur, -1)
+        changes.add(group_id, date_entered, user_id, 'settled', amount_eur, 1)
+    ledger.record_settled(group_id, settled)
+    rollups.record(changes)
+    if rows:
+        bump_data_version(group_id)
+        live.publish('refresh', group_id=group_id)
+    return len(rows), sum(settled.values(), Decimal('0.00'))
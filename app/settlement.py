@@ -0,0 +1,188 @@
+"""Chunked, background "settle all".
+
+Settling every unsettled expense in one ``UPDATE`` holds row locks on all of
+them for the whole statement and can outlive the worker timeout. Instead a
+:class:`~app.models.SettlementBatch` is recorded and a background thread
+settles it in chunks of ``SETTLE_CHUNK_SIZE``, committing after each one:
+
+* on PostgreSQL each chunk is claimed with ``FOR UPDATE SKIP LOCKED``, so rows
+  being edited right now are passed over and picked up at the end;
+* elsewhere chunks walk forward through the id range.
+
+Only expenses that existed when the batch started are settled. Progress is
+stored on the batch row, which the admin page polls. Batches, like
+settlement periods, belong to one group; groups settle independently.
+
+Starting a batch also closes the group's current settlement period: a
+:class:`~app.models.Settlement` freezes every member's balance and the
+transfers that settle it, and later balances start from there.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+from sqlalchemy import func
+
+from app import db, live, services
+from app.balances import snapshot_balances, settle_up
+from app.fragments import bump_data_version
+from app.models import Expense, SettlementBatch, Settlement, SettlementShare, SettlementTransfer
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+
+def _is_stale(batch):
+    stale_after = timedelta(seconds=current_app.config['SETTLE_STALE_SECONDS'])
+    return batch.updated_at < datetime.utcnow() - stale_after
+
+
+def active_batch(group_id):
+    """The batch currently settling the group, if any.
+
+    A batch that has not made progress for ``SETTLE_STALE_SECONDS`` (e.g. its
+    worker was restarted) no longer counts as active.
+    """
+    batch = SettlementBatch.query.filter(
+        SettlementBatch.group_id == group_id,
+        SettlementBatch.status.in_(ACTIVE_STATUSES)
+    ).order_by(SettlementBatch.id.desc()).first()
+    if batch is None or _is_stale(batch):
+        return None
+    return batch
+
+
+def start_settle_all(group_id, started_by_id):
+    """Record a new batch for the group and start settling it.
+
+    Returns ``(batch, started)``; ``started`` is False if another batch was
+    already running for the group, in which case that batch is returned.
+    """
+    running = active_batch(group_id)
+    if running is not None:
+        return running, False
+
+    # Close out batches abandoned by a restarted worker. Whatever they had
+    # not settled yet is still unsettled and is picked up by the new batch.
+    SettlementBatch.query.filter(
+        SettlementBatch.group_id == group_id,
+        SettlementBatch.status.in_(ACTIVE_STATUSES)
+    ).update({'status': 'failed', 'finished_at': datetime.utcnow(),
+              'error': 'Abandoned: no progress was made (was the worker restarted?)'})
+
+    max_id, count, amount = db.session.query(
+        func.max(Expense.id),
+        func.count(Expense.id),
+        func.coalesce(func.sum(Expense.amount_eur), 0)
+    ).filter(Expense.group_id == group_id, Expense.status == 'unsettled').one()
+
+    batch = SettlementBatch(group_id=group_id, started_by_id=started_by_id,
+                            max_expense_id=max_id or 0, total_count=count, total_amount=amount)
+    db.session.add(batch)
+    db.session.flush()
+    close_period(group_id, started_by_id, batch.id)
+    db.session.commit()
+
+    if current_app.config['SETTLE_IN_BACKGROUND']:
+        app = current_app._get_current_object()
+        thread = threading.Thread(target=_run_in_app, args=(app, batch.id, started_by_id),
+                                  name=f'settle-batch-{batch.id}', daemon=True)
+        thread.start()
+    else:
+        run_batch(batch.id)
+    return batch, True
+
+
+def close_period(group_id, closed_by_id, batch_id=None):
+    """Snapshot the group's current period into a new :class:`Settlement`.
+
+    Returns ``None`` without closing anything if the period has no expenses.
+    Runs in the caller's transaction; the caller commits.
+    """
+    summary, cumulative = snapshot_balances(group_id)
+    expense_count = sum(m.expense_count for m in summary.members)
+    if not expense_count and not summary.total_expenses:
+        return None
+
+    settlement = Settlement(group_id=group_id, closed_by_id=closed_by_id, batch_id=batch_id,
+                            period_start=summary.period_start,
+                            total_expenses=summary.total_expenses,
+                            expense_count=expense_count,
+                            member_count=summary.member_count,
+                            cost_per_person=summary.cost_per_person)
+    db.session.add(settlement)
+    db.session.flush()
+
+    db.session.add_all(SettlementShare(
+        settlement_id=settlement.id, user_id=m.user_id, name=m.name,
+        paid=m.total_paid, expense_count=m.expense_count,
+        share=summary.cost_per_person, net=m.balance,
+        cumulative_paid=cumulative[m.user_id][0],
+        cumulative_count=cumulative[m.user_id][1]
+    ) for m in summary.members)
+    db.session.add_all(SettlementTransfer(
+        settlement_id=settlement.id, from_user_id=t.from_user_id, from_name=t.from_name,
+        to_user_id=t.to_user_id, to_name=t.to_name, amount=t.amount
+    ) for t in settle_up(summary.members))
+    bump_data_version(group_id)
+    live.publish('refresh', group_id=group_id)
+    return settlement
+
+
+def _run_in_app(app, batch_id, started_by_id):
+    with app.app_context():
+        # Credit the audit events to whoever started the batch
+        g.audit_actor_id = started_by_id
+        run_batch(batch_id)
+
+
+def _next_chunk(batch, after_id, skip_locked):
+    query = db.session.query(Expense.id).filter(
+        Expense.group_id == batch.group_id,
+        Expense.status == 'unsettled',
+        Expense.id > after_id,
+        Expense.id <= batch.max_expense_id
+    ).order_by(Expense.id).limit(current_app.config['SETTLE_CHUNK_SIZE'])
+    if skip_locked:
+        query = query.with_for_update(skip_locked=True)
+    return [expense_id for (expense_id,) in query]
+
+
+def run_batch(batch_id):
+    """Settle a batch chunk by chunk, committing after each chunk"""
+    batch = db.session.get(SettlementBatch, batch_id)
+    batch.status = 'running'
+    batch.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    is_postgres = db.session.get_bind().dialect.name == 'postgresql'
+    try:
+        after_id = 0
+        skip_locked = is_postgres
+        while True:
+            expense_ids = _next_chunk(batch, after_id, skip_locked)
+            if not expense_ids:
+                if skip_locked:
+                    # Everything left was locked by concurrent edits; take a
+                    # final pass that waits for those few rows
+                    skip_locked = False
+                    continue
+                break
+            if not is_postgres:
+                after_id = expense_ids[-1]
+
+            count, amount = services.settle_expense_ids(batch.group_id, expense_ids)
+            batch.settled_count += count
+            batch.settled_amount += amount
+            batch.updated_at = datetime.utcnow()
+            db.session.commit()
+
+        batch.status = 'done'
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Settlement batch %s failed', batch_id)
+        batch = db.session.get(SettlementBatch, batch_id)
+        batch.status = 'failed'
+        batch.error = str(e)
+    batch.finished_at = datetime.utcnow()
+    db.session.commit()
+    return batch
@@ -0,0 +1,245 @@
+"""Cache of lightweight user principals for Flask-Login.
+
+``load_user`` runs on every authenticated request. Instead of hydrating a
+full ``User`` each time, it returns a :class:`UserPrincipal` built from a
+cached dict. Entries are dropped whenever a transaction that changed or
+deleted a ``User`` commits.
+
+Backends (``USER_CACHE_BACKEND``):
+
+* ``memory`` - per-process TTL/LRU cache (default)
+* ``filesystem`` - one JSON file per user under ``USER_CACHE_DIR`` (default:
+  the instance folder), shared by every worker on the host. The directory
+  must belong to the app's user and is kept private to it
+* ``redis`` - shared Redis at ``USER_CACHE_REDIS_URL`` (needs ``redis``)
+* ``null`` - no caching
+"""
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import User, Group, GroupMembership
+
+PRINCIPAL_FIELDS = ('id', 'email', 'full_name', 'is_admin', 'force_password_change')
+
+
+class UserPrincipal(UserMixin):
+    """Read-only view of a user, used as ``current_user``"""
+
+    def __init__(self, id, email, full_name, is_admin, force_password_change, groups=()):
+        self.id = id
+        self.email = email
+        self.full_name = full_name
+        self.is_admin = is_admin
+        self.force_password_change = force_password_change
+        # ``(id, name)`` of every group the user is a member of, by name
+        self.groups = [tuple(group) for group in groups]
+        self.group_ids = [group_id for group_id, _ in self.groups]
+
+    def __repr__(self):
+        return f'<UserPrincipal {self.email}>'
+
+
+class NullBackend:
+    def get(self, user_id):
+        return None
+
+    def set(self, user_id, data):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+
+class MemoryBackend:
+    """Per-process TTL/LRU cache; also used for rendered fragments"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _private_directory(directory):
+    """Create ``directory`` readable by this user only, or check an existing one.
+
+    Cached principals decide who is an admin, so refuse a directory that
+    another user could have created or can write to.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f'USER_CACHE_DIR {directory!r} is not a directory')
+    if hasattr(os, 'getuid'):
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f'USER_CACHE_DIR {directory!r} belongs to another user')
+        if info.st_mode & 0o077:
+            os.chmod(directory, 0o700)
+
+
+class FilesystemBackend:
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        _private_directory(directory)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f'user-{int(user_id)}.json')
+
+    def get(self, user_id):
+        path = self._path(user_id)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, user_id, data):
+        # Write to a temp file and rename so readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(user_id))
+
+    def delete(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+class RedisBackend:
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("USER_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, user_id):
+        return f'user-principal:{int(user_id)}'
+
+    def get(self, user_id):
+        raw = self.client.get(self._key(user_id))
+        return json.loads(raw) if raw else None
+
+    def set(self, user_id, data):
+        self.client.setex(self._key(user_id), self.ttl, json.dumps(data))
+
+    def delete(self, user_id):
+        self.client.delete(self._key(user_id))
+
+
+def _create_backend(app):
+    config = app.config
+    name = config['USER_CACHE_BACKEND']
+    ttl = config['USER_CACHE_TTL']
+    if name == 'memory':
+        return MemoryBackend(ttl, config['USER_CACHE_SIZE'])
+    if name == 'filesystem':
+        directory = config['USER_CACHE_DIR'] or os.path.join(app.instance_path, 'user-cache')
+        return FilesystemBackend(directory, ttl)
+    if name == 'redis':
+        return RedisBackend(config['USER_CACHE_REDIS_URL'], ttl)
+    if name == 'null':
+        return NullBackend()
+    raise ValueError(f'Unknown USER_CACHE_BACKEND: {name!r}')
+
+
+def _backend():
+    return current_app.extensions['user_cache']
+
+
+def load_principal(user_id):
+    """Return the :class:`UserPrincipal` for ``user_id``, or ``None``"""
+    backend = _backend()
+    data = backend.get(user_id)
+    if data is None:
+        # Read from the primary: a stale principal would be cached for a while.
+        # One row per group, or a single row with no group.
+        rows = db.session.query(
+            *(getattr(User, field) for field in PRINCIPAL_FIELDS), Group.id, Group.name
+        ).outerjoin(
+            GroupMembership, GroupMembership.user_id == User.id
+        ).outerjoin(
+            Group, Group.id == GroupMembership.group_id
+        ).filter(User.id == user_id).order_by(Group.name).execution_options(use_primary=True).all()
+        if not rows:
+            return None
+        data = dict(zip(PRINCIPAL_FIELDS, rows[0]))
+        data['groups'] = [[row[-2], row[-1]] for row in rows if row[-2] is not None]
+        backend.set(user_id, data)
+    return UserPrincipal(**data)
+
+
+def invalidate(user_id):
+    _backend().delete(user_id)
+
+
+# Write-through invalidation: remember which users a transaction touched and
+# drop their cache entries once it commits.
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_users(session, flush_context, instances):
+    changed = session.info.setdefault('changed_user_ids', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+    # Principals list their groups
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, GroupMembership):
+            changed.add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    changed = session.info.pop('changed_user_ids', None)
+    if changed and has_app_context() and 'user_cache' in current_app.extensions:
+        for user_id in changed:
+            invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+
+
+def init_app(app):
+    app.extensions['user_cache'] = _create_backend(app)
@@ -0,0 +1,122 @@
+"""Concurrent edit stress test.
+
+Several writer threads edit the same expense through the real edit form,
+each adding one cent at a time: load the form, add a cent, save. A save
+that loses the optimistic-locking race (409) is retried from a fresh form.
+Afterwards the expense must have grown by exactly one cent per successful
+save, and the balance ledger must still match the expense table - any lost
+update fails the run.
+
+Usage (from the project root)::
+
+    python -m benchmarks.concurrency --writers 8 --edits 25
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app import create_app, db, services
+from app.ledger import rebuild_ledger
+from app.models import Expense
+from app.schema import upgrade_schema
+from benchmarks.run import logged_in_client, make_config
+from benchmarks.seed import seed_users
+
+CENT = Decimal('0.01')
+
+_AMOUNT = re.compile(r'id="amount_eur"[^>]*value="([^"]*)"')
+_VERSION = re.compile(r'id="version"[^>]*value="([^"]*)"')
+
+
+def edit_repeatedly(client, expense_id, edits, send_version):
+    """Add a cent ``edits`` times; returns the number of conflicts retried"""
+    conflicts = 0
+    done = 0
+    while done < edits:
+        page = client.get(f'/edit-expense/{expense_id}').get_data(as_text=True)
+        data = {
+            'expense_id': expense_id,
+            'amount_eur': str(Decimal(_AMOUNT.search(page).group(1)) + CENT),
+            'note': 'stress test',
+        }
+        if send_version:
+            data['version'] = _VERSION.search(page).group(1)
+        response = client.post(f'/edit-expense/{expense_id}', data=data)
+        if response.status_code == 302:
+            done += 1
+        elif response.status_code == 409:
+            conflicts += 1
+        else:
+            raise RuntimeError(f'edit failed with {response.status_code}')
+    return conflicts
+
+
+def run(database_url, writers, edits, send_version):
+    app = create_app(make_config(database_url))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        upgrade_schema()
+        group_id, emails = seed_users(1)
+        expense = services.add_expense(group_id, 1, Decimal('1.00'), 'stress test')
+        db.session.commit()
+        expense_id, start = expense.id, expense.amount_eur
+
+    clients = [logged_in_client(app, emails[0]) for _ in range(writers)]
+    barrier = threading.Barrier(writers)
+
+    def writer(client):
+        barrier.wait()
+        return edit_repeatedly(client, expense_id, edits, send_version)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(writers) as pool:
+        conflicts = sum(pool.map(writer, clients))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        app.extensions['audit_writer'].flush()
+        final = db.session.get(Expense, expense_id).amount_eur
+        drift = rebuild_ledger(dry_run=True)
+        db.session.rollback()
+        db.session.remove()
+        db.engine.dispose()
+
+    expected = start + CENT * writers * edits
+    print(f'{writers} writers x {edits} edits in {elapsed:.2f}s, {conflicts} conflict(s) retried')
+    print(f'amount: expected {expected}, got {final}'
+          f' ({int((expected - final) / CENT)} lost update(s))')
+    print(f'ledger drift: {len(drift)} value(s)')
+    return final == expected and not drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--writers', type=int, default=8, help='parallel writers (default: 8)')
+    parser.add_argument('--edits', type=int, default=25, help='edits per writer (default: 25)')
+    parser.add_argument('--without-version', action='store_true',
+                        help="don't send the form's version, to show the updates it protects")
+    parser.add_argument('--database-url',
+                        help='database to test against (default: a temporary SQLite file)')
+    parser.add_argument('--reset-database', action='store_true',
+                        help='confirm that all tables in --database-url may be dropped')
+    args = parser.parse_args(argv)
+
+    if args.database_url and not args.reset_database:
+        parser.error('--database-url drops and recreates all tables; pass --reset-database to confirm')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = args.database_url or 'sqlite:///' + os.path.join(tmp_dir, 'stress.db')
+        ok = run(database_url, args.writers, args.edits, not args.without_version)
+    print('✓ No lost updates.' if ok else '✗ Updates were lost.')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""Route performance benchmarks.
+
+Builds the app with ``create_app`` against a throwaway SQLite file (or a
+local PostgreSQL database), seeds synthetic data at each requested volume and
+drives the hot routes through the Flask test client. For every route it
+records p50/p95 latency and SQL statements per request, plus the peak RSS of
+the process, and can save the results as a JSON baseline or compare a run
+against one.
+
+Usage (from the project root)::
+
+    python -m benchmarks.run --volumes 1000,100000 --output benchmarks/baseline.json
+    python -m benchmarks.run --volumes 1000,100000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app, db
+from app.api import create_token
+from app.schema import upgrade_schema
+from benchmarks.seed import BENCH_PASSWORD, seed
+from config import Config
+
+_statements = [0]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(*args):
+    _statements[0] += 1
+
+
+def make_config(database_url):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        WTF_CSRF_ENABLED = False
+        QUERY_BUDGET_STRICT = False
+        USER_CACHE_BACKEND = 'memory'
+        # Time the whole chunked settlement, not just starting it
+        SETTLE_IN_BACKGROUND = False
+    return BenchConfig
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def measure(request, repeat, warmup=True):
+    """Run ``request`` ``repeat`` times and summarise latency and SQL use.
+
+    One untimed warm-up request compiles templates and fills caches first.
+    """
+    if warmup:
+        request()
+    timings, statements = [], []
+    for _ in range(repeat):
+        _statements[0] = 0
+        started = time.perf_counter()
+        response = request()
+        timings.append((time.perf_counter() - started) * 1000)
+        statements.append(_statements[0])
+        if response.status_code >= 400:
+            raise RuntimeError(f'benchmark request failed with {response.status_code}')
+    return {
+        'samples': repeat,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'queries': max(statements),
+    }
+
+
+def measure_concurrent(request, repeat, concurrency):
+    """Like :func:`measure`, with ``concurrency`` requests in flight at once.
+
+    Adds the overall throughput. Statement counts from parallel requests
+    cannot be told apart, so ``queries`` is the average per request.
+    """
+    request()
+
+    def timed(_):
+        started = time.perf_counter()
+        response = request()
+        if response.status_code >= 400:
+            raise RuntimeError(f'benchmark request failed with {response.status_code}')
+        return (time.perf_counter() - started) * 1000
+
+    _statements[0] = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        timings = list(pool.map(timed, range(repeat)))
+    elapsed = time.perf_counter() - started
+    return {
+        'samples': repeat,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'queries': math.ceil(_statements[0] / repeat),
+        'per_second': round(repeat / elapsed, 1),
+    }
+
+
+def logged_in_client(app, email):
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'could not log in as {email}')
+    return client
+
+
+def run_volume(database_url, volume, users, repeat):
+    app = create_app(make_config(database_url))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        upgrade_schema()
+
+        started = time.perf_counter()
+        group_id, emails = seed(users, volume)
+        seed_seconds = time.perf_counter() - started
+        _, api_token = create_token(1, group_id, 'benchmark')
+        db.session.commit()
+
+    admin = logged_in_client(app, emails[0])
+    member = logged_in_client(app, emails[-1])
+
+    def login():
+        return app.test_client().post(
+            '/login', data={'email': emails[-1], 'password': BENCH_PASSWORD}
+        )
+
+    results = {
+        'seed_seconds': round(seed_seconds, 3),
+        'login': measure(login, max(1, repeat // 4)),
+        # A burst of logins, e.g. everyone opening the app after a reminder
+        'login_burst': measure_concurrent(login, max(1, repeat // 2), concurrency=8),
+        'dashboard': measure(lambda: member.get('/dashboard'), repeat),
+        'admin': measure(lambda: admin.get('/admin'), repeat),
+        'search': measure(lambda: member.get('/search?q=pool+maint'), repeat),
+        'reports': measure(lambda: member.get('/reports'), repeat),
+        'api_balances': measure(lambda: member.get(
+            '/api/v1/balances', headers={'Authorization': f'Bearer {api_token}'}), repeat),
+        # Settling is destructive, so it is measured once per volume
+        'settle_expenses': measure(lambda: admin.post('/settle-expenses'), 1, warmup=False),
+    }
+    results['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    with app.app_context():
+        app.extensions['audit_writer'].flush()
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    """Return a list of human-readable regressions against ``baseline``.
+
+    A route's p95 only counts as regressed if it is both ``tolerance`` slower
+    relatively and ``min_delta_ms`` slower absolutely, so millisecond-scale
+    noise on fast routes does not fail the comparison.
+    """
+    regressions = []
+    for volume, scenarios in current['results'].items():
+        base_scenarios = baseline.get('results', {}).get(volume)
+        if not base_scenarios:
+            continue
+        for name, stats in scenarios.items():
+            base = base_scenarios.get(name)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            slower_ms = stats['p95_ms'] - base['p95_ms']
+            if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance) and slower_ms > min_delta_ms:
+                regressions.append(f'{volume} rows, {name}: p95 {base["p95_ms"]}ms -> {stats["p95_ms"]}ms')
+            if stats['queries'] > base['queries']:
+                regressions.append(f'{volume} rows, {name}: queries {base["queries"]} -> {stats["queries"]}')
+        base_rss = base_scenarios.get('peak_rss_mb')
+        if base_rss and scenarios['peak_rss_mb'] > base_rss * (1 + tolerance):
+            regressions.append(f'{volume} rows: peak RSS {base_rss}MB -> {scenarios["peak_rss_mb"]}MB')
+    return regressions
+
+
+def print_results(results):
+    for volume, scenarios in results.items():
+        print(f'\n{volume} expenses (seeded in {scenarios["seed_seconds"]}s, '
+              f'peak RSS {scenarios["peak_rss_mb"]}MB)')
+        for name, stats in scenarios.items():
+            if isinstance(stats, dict):
+                line = (f'  {name:<16} p50 {stats["p50_ms"]:>9.2f}ms  p95 {stats["p95_ms"]:>9.2f}ms  '
+                        f'queries {stats["queries"]:>3}  (n={stats["samples"]})')
+                if 'per_second' in stats:
+                    line += f'  {stats["per_second"]}/s at concurrency {stats["concurrency"]}'
+                print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--volumes', default='1000,10000',
+                        help='comma-separated expense counts to benchmark (default: 1000,10000)')
+    parser.add_argument('--users', type=int, default=4, help='number of users to seed (default: 4)')
+    parser.add_argument('--repeat', type=int, default=20, help='requests per route (default: 20)')
+    parser.add_argument('--database-url',
+                        help='database to benchmark against (default: a temporary SQLite file)')
+    parser.add_argument('--reset-database', action='store_true',
+                        help='confirm that all tables in --database-url may be dropped')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown before a route counts as regressed (default: 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help='ignore p95 slowdowns smaller than this (default: 2.0)')
+    args = parser.parse_args(argv)
+
+    if args.database_url and not args.reset_database:
+        parser.error('--database-url drops and recreates all tables; pass --reset-database to confirm')
+
+    volumes = [int(volume) for volume in args.volumes.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for volume in volumes:
+            database_url = args.database_url or \
+                'sqlite:///' + os.path.join(tmp_dir, f'bench-{volume}.db')
+            results[str(volume)] = run_volume(database_url, volume, args.users, args.repeat)
+
+    report = {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'database': (args.database_url or 'sqlite').split(':')[0],
+            'python': platform.python_version(),
+            'users': args.users,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\n✓ Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print('\n✗ Regressions against the baseline:')
+            for regression in regressions:
+                print(f'  - {regression}')
+            return 1
+        print('\n✓ No regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
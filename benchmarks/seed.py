@@ -0,0 +1,91 @@
+"""Synthetic data generator for the benchmarks.
+
+Inserts users and expenses through the same batched path as the bulk
+importer (``COPY`` on PostgreSQL), so a million expenses take seconds rather
+than the hours the web form would need.
+"""
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+
+from app import db
+from app.groups import create_group
+from app.importer import insert_batch
+from app.models import User, GroupMembership
+from app.passwords import hash_password
+
+BENCH_PASSWORD = 'bench-password'
+
+
+def seed_users(count, password=BENCH_PASSWORD):
+    """Create ``count`` users in one new group; user 1 is an admin.
+
+    Returns ``(group_id, emails)``.
+    """
+    # Hashing is deliberately slow, so hash once and share it
+    password_hash = hash_password(password)
+    users = [
+        User(email=f'user{i}@bench.example.com', full_name=f'Bench User {i}',
+             password_hash=password_hash, is_admin=(i == 1),
+             force_password_change=False)
+        for i in range(1, count + 1)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    group = create_group('Bench household', [user.id for user in users])
+    db.session.commit()
+    return group.id, [user.email for user in users]
+
+
+def seed_expenses(count, group_id, years=3, unsettled_ratio=0.1, batch_size=10000, rng=None):
+    """Insert ``count`` expenses of a group, spread over the last ``years`` years.
+
+    The newest ``unsettled_ratio`` of them are unsettled, like a real
+    history where only the current period is open.
+    """
+    rng = rng or random.Random(42)
+    user_ids = [user_id for (user_id,) in db.session.query(GroupMembership.user_id)
+                .filter_by(group_id=group_id).order_by(GroupMembership.user_id)]
+    now = datetime.utcnow()
+    span = timedelta(days=365 * years)
+    unsettled_from = count - int(count * unsettled_ratio)
+
+    batch = []
+    for i in range(count):
+        batch.append({
+            'date_entered': now - span + span * (i / max(count, 1)),
+            'amount_eur': Decimal(rng.randint(100, 50000)) / 100,
+            'note': f'Synthetic expense {i} {rng.choice(NOTE_WORDS)} {rng.choice(NOTE_WORDS)}',
+            'user_id': rng.choice(user_ids),
+            'status': 'unsettled' if i >= unsettled_from else 'settled',
+        })
+        if len(batch) >= batch_size:
+            insert_batch(group_id, batch)
+            batch = []
+    insert_batch(group_id, batch)
+    db.session.commit()
+
+
+def seed(users, expenses):
+    """Seed ``users`` in one group and ``expenses`` of theirs; returns ``(group_id, emails)``.
+
+    Synthetic history needs no audit trail, so the audit log is off meanwhile.
+    """
+    config = current_app.config
+    audit_mode = config['AUDIT_LOG_MODE']
+    config['AUDIT_LOG_MODE'] = 'off'
+    try:
+        group_id, emails = seed_users(users)
+        seed_expenses(expenses, group_id)
+    finally:
+        config['AUDIT_LOG_MODE'] = audit_mode
+    return group_id, emails
+
+
+NOTE_WORDS = (
+    'groceries', 'electricity', 'water', 'internet', 'pool maintenance',
+    'gardening', 'cleaning', 'repairs', 'furniture', 'property tax',
+    'insurance', 'fuel', 'restaurant', 'supplies', 'plumber',
+)
@@ -1,5 +1,10 @@
 from app import create_app, db
-from app.models import User
+from app.models import User, Group
+from app.groups import DEFAULT_GROUP_NAME, create_group
+from app.ledger import rebuild_ledger
+from app.passwords import hash_passwords
+from app.rollups import rebuild_rollups
+from app.schema import upgrade_schema
 import sys
 
 def init_database():
@@ -22,6 +27,7 @@ def init_database():
         try:
             # Create all tables
             db.create_all()
+            upgrade_schema()
             print("✓ Database tables created successfully")
             
             # Check if users already exist
@@ -54,16 +60,21 @@ def init_database():
                     }
                 ]
                 
-                for user_data in users:
+                # Hashing is slow on purpose; do all users at once
+                password_hashes = hash_passwords([user_data['password'] for user_data in users])
+                for user_data, password_hash in zip(users, password_hashes):
                     user = User(
                         email=user_data['email'],
                         full_name=user_data['full_name'],
                         is_admin=user_data['is_admin'],
-                        force_password_change=True
+                        force_password_change=True,
+                        password_hash=password_hash
                     )
-                    user.set_password(user_data['password'])
                     db.session.add(user)
                 
+                # Everyone starts in one household
+                db.session.flush()
+                create_group(DEFAULT_GROUP_NAME, [user.id for user in User.query])
                 db.session.commit()
                 print("\n✓ Database initialized successfully!")
                 print("\nInitial users created:")
@@ -75,6 +86,22 @@ def init_database():
             else:
                 print("\n✓ Database already contains users. Skipping user creation.")
                 
+            for group in Group.query.order_by(Group.id):
+                print(f"✓ Household {group.id}: {group.name} ({len(group.members)} member(s))")
+                
+            # Bring the balance ledger in line with the expense table
+            drift = rebuild_ledger()
+            db.session.commit()
+            if drift:
+                print(f"✓ Balance ledger rebuilt ({len(drift)} value(s) corrected)")
+            else:
+                print("✓ Balance ledger is up to date")
+            
+            # Backfill the reporting rollups from the expense table
+            rollup_rows = rebuild_rollups()
+            db.session.commit()
+            print(f"✓ Monthly rollups rebuilt ({rollup_rows} row(s))")
+                
         except Exception as e:
             print(f"\n✗ Error initializing database: {e}")
             db.session.rollback()
@@ -0,0 +1,75 @@
+import pytest
+
+from config import Config
+from app import create_app, db
+from app.groups import create_group
+from app.models import User
+from app.schema import upgrade_schema
+
+PASSWORD = 'password'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build an app on a fresh SQLite file; ``overrides`` replace config values"""
+    def make(**overrides):
+        class TestConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+            TESTING = True
+            WTF_CSRF_ENABLED = False
+            PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+            AUDIT_LOG_MODE = 'sync'
+            SETTLE_IN_BACKGROUND = False
+        for name, value in overrides.items():
+            setattr(TestConfig, name, value)
+        return create_app(TestConfig)
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    """An app with an admin and two members in one household"""
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        users = []
+        for email, is_admin in (('admin@example.com', True), ('member@example.com', False),
+                                ('other@example.com', False)):
+            user = User(email=email, full_name=email.split('@')[0].title(), is_admin=is_admin,
+                        force_password_change=False)
+            user.set_password(PASSWORD)
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+        create_group('Home', [user.id for user in users])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def add_user(email):
+    """Add a user outside any group, in the current app context; returns the id"""
+    user = User(email=email, full_name=email.split('@')[0].title(), force_password_change=False)
+    user.set_password(PASSWORD)
+    db.session.add(user)
+    db.session.flush()
+    return user.id
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def admin_client(app):
+    return login(app.test_client(), 'admin@example.com')
+
+
+@pytest.fixture
+def member_client(app):
+    return login(app.test_client(), 'member@example.com')
@@ -0,0 +1,56 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app import db, services
+from app.audit import balances_as_of, expenses_as_of
+from app.balances import compute_balances
+from app.models import Expense
+
+
+def _expenses():
+    return [(expense.id, expense.date_entered, expense.amount_eur, expense.note,
+             expense.status, expense.user_id)
+            for expense in Expense.query.order_by(Expense.id)]
+
+
+@pytest.mark.parametrize('statement', (
+    "UPDATE expense_event SET action = 'deleted'",
+    'DELETE FROM expense_event',
+))
+def test_audit_log_is_append_only(app, statement):
+    with app.app_context():
+        services.add_expense(1, 2, '10.00', 'rent')
+        db.session.commit()
+        with pytest.raises(DBAPIError, match='append-only'):
+            db.session.execute(text(statement))
+        db.session.rollback()
+
+
+def test_replay_restores_expenses_and_balances_as_of_a_time(app):
+    with app.app_context():
+        rent = services.add_expense(1, 2, '10.00', 'rent')
+        milk = services.add_expense(1, 3, '5.00', 'milk')
+        db.session.commit()
+        then, expenses_then, balances_then = datetime.utcnow(), _expenses(), compute_balances(1)
+
+        services.update_expense(rent, '12.00', 'rent and water')
+        services.delete_expense(milk)
+        services.add_expense(1, 1, '3.00', 'bulbs')
+        services.settle_expense(rent)
+        db.session.commit()
+
+        assert list(expenses_as_of(1, then)) == expenses_then
+        assert list(expenses_as_of(1, datetime.utcnow())) == _expenses()
+        assert balances_as_of(1, then) == balances_then
+        assert balances_as_of(1, then).total_expenses == Decimal('15.00')
+        assert balances_as_of(1, datetime.utcnow()) == compute_balances(1)
+        assert list(expenses_as_of(1, datetime(2000, 1, 1))) == []
+
+
+def test_unknown_audit_modes_are_refused_at_startup(make_app):
+    with pytest.raises(ValueError, match="Unknown AUDIT_LOG_MODE: 'synchronous'"):
+        make_app(AUDIT_LOG_MODE='synchronous')
@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from app import db, services
+from app.balances import compute_balances
+from app.groups import add_member
+from tests.conftest import add_user
+
+
+def _balances(summary):
+    return {member.user_id: member.balance for member in summary.members}
+
+
+def test_balances_are_exact_cents_split_between_the_members(app):
+    with app.app_context():
+        # Ten dimes sum to 0.9999999999999999 in floats
+        for _ in range(10):
+            services.add_expense(1, 1, '0.10', 'dime')
+        services.add_expense(1, 2, '9.01', 'groceries')
+        db.session.commit()
+
+        summary = compute_balances(1)
+        assert summary.total_expenses == Decimal('10.01')
+        assert summary.member_count == 3
+        # 3.3366... rounds half up to the cent
+        assert summary.cost_per_person == Decimal('3.34')
+        assert all(isinstance(member.balance, Decimal) for member in summary.members)
+        assert _balances(summary) == {1: Decimal('-2.34'), 2: Decimal('5.67'),
+                                      3: Decimal('-3.34')}
+        assert [member.user_id for member in summary.members] == [2, 1, 3]
+
+        add_member(1, add_user('fourth@example.com'))
+        db.session.commit()
+
+        summary = compute_balances(1)
+        assert summary.member_count == 4
+        assert summary.cost_per_person == Decimal('2.50')
+        assert summary.members[-1].balance == Decimal('-2.50')
+
+
+def test_users_outside_the_group_do_not_share_its_costs(app):
+    with app.app_context():
+        add_user('outsider@example.com')
+        services.add_expense(1, 1, '30.00', 'rent')
+        db.session.commit()
+
+        summary = compute_balances(1)
+        assert summary.member_count == 3
+        assert summary.cost_per_person == Decimal('10.00')
@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app import db
+from app.api import create_token
+from app.ledger import rebuild_ledger
+from app.models import Expense, User
+from benchmarks.concurrency import CENT, edit_repeatedly
+from tests.conftest import login
+
+
+def _expense(member_client, app, amount='10.00'):
+    member_client.post('/dashboard', data={'amount_eur': amount, 'note': 'groceries'})
+    with app.app_context():
+        expense = Expense.query.order_by(Expense.id.desc()).first()
+        return expense.id, expense.version
+
+
+def _change_behind_the_form(app, expense_id, amount):
+    with app.app_context():
+        db.session.get(Expense, expense_id).amount_eur = Decimal(amount)
+        db.session.commit()
+
+
+def test_edit_form_renders_one_version_field(app, member_client):
+    expense_id, _ = _expense(member_client, app)
+    page = member_client.get(f'/edit-expense/{expense_id}').get_data(as_text=True)
+    assert page.count('name="version"') == 1
+
+
+def test_stale_edit_gets_409_with_current_values(app, member_client):
+    expense_id, version = _expense(member_client, app)
+    _change_behind_the_form(app, expense_id, '12.00')
+
+    response = member_client.post(f'/edit-expense/{expense_id}', data={
+        'expense_id': expense_id, 'version': version, 'amount_eur': '11.00', 'note': 'mine'
+    })
+    assert response.status_code == 409
+    page = response.get_data(as_text=True)
+    assert '12.00' in page
+    # What the user typed is kept, with the current version to overwrite on resubmit
+    assert 'value="11.00"' in page
+    assert f'value="{version + 1}"' in page
+    with app.app_context():
+        assert db.session.get(Expense, expense_id).amount_eur == Decimal('12.00')
+
+
+def test_stale_delete_flashes_or_answers_409_in_the_background(app, member_client):
+    expense_id, version = _expense(member_client, app)
+    _change_behind_the_form(app, expense_id, '12.00')
+
+    response = member_client.post(f'/delete-expense/{expense_id}', data={'version': version},
+                                  headers={'X-Live-Update': '1'})
+    assert response.status_code == 409 and response.data == b''
+
+    response = member_client.post(f'/delete-expense/{expense_id}', data={'version': version})
+    assert response.status_code == 302
+    assert 'was not deleted' in member_client.get('/dashboard').get_data(as_text=True)
+    with app.app_context():
+        assert db.session.get(Expense, expense_id) is not None
+
+
+def test_stale_settle_flashes_and_redirects(app, admin_client, member_client):
+    expense_id, version = _expense(member_client, app)
+    _change_behind_the_form(app, expense_id, '12.00')
+
+    response = admin_client.post(f'/settle-expense/{expense_id}', data={'version': version})
+    assert response.status_code == 302
+    assert 'was not settled' in admin_client.get('/admin').get_data(as_text=True)
+    with app.app_context():
+        assert db.session.get(Expense, expense_id).status == 'unsettled'
+
+
+def test_api_changes_with_an_old_version_get_409(app, member_client):
+    expense_id, version = _expense(member_client, app)
+    with app.app_context():
+        member_id = db.session.query(User.id).filter_by(email='member@example.com').scalar()
+        _, token = create_token(member_id, 1, 'tests')
+        db.session.commit()
+    headers = {'Authorization': f'Bearer {token}'}
+    _change_behind_the_form(app, expense_id, '12.00')
+
+    response = member_client.patch(f'/api/v1/expenses/{expense_id}', headers=headers,
+                                   json={'amount_eur': '11.00', 'version': version})
+    assert response.status_code == 409
+    assert response.get_json()['current']['amount_eur'] == '12.00'
+    response = member_client.delete(f'/api/v1/expenses/{expense_id}?version={version}',
+                                    headers=headers)
+    assert response.status_code == 409
+
+    response = member_client.patch(f'/api/v1/expenses/{expense_id}', headers=headers,
+                                   json={'amount_eur': '11.00', 'version': version + 1})
+    assert response.status_code == 200
+
+
+def test_parallel_writers_lose_no_updates(app, member_client):
+    expense_id, _ = _expense(member_client, app, '1.00')
+    writers, edits = 4, 5
+    clients = [login(app.test_client(), 'member@example.com') for _ in range(writers)]
+    barrier = threading.Barrier(writers)
+
+    def writer(client):
+        barrier.wait()
+        return edit_repeatedly(client, expense_id, edits, send_version=True)
+
+    with ThreadPoolExecutor(writers) as pool:
+        list(pool.map(writer, clients))
+
+    with app.app_context():
+        assert db.session.get(Expense, expense_id).amount_eur == \
+            Decimal('1.00') + CENT * writers * edits
+        assert rebuild_ledger(dry_run=True) == []
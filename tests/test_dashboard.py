@@ -0,0 +1,67 @@
+from flask_login import login_user
+
+from app import db, user_cache
+from app.fragments import current_data_version
+from app.models import Expense, User
+from app.routes import DashboardFragments
+from tests.conftest import login
+
+
+def test_load_more_link_cached_by_live_stream_points_at_dashboard(app, member_client):
+    app.config['EXPENSES_PER_PAGE'] = 2
+    for note in ('one', 'two', 'three'):
+        member_client.post('/dashboard', data={'amount_eur': '1.00', 'note': note})
+
+    # The live stream renders (and caches) the expenses fragment first
+    with app.test_request_context('/events'):
+        member_id = db.session.query(User.id).filter_by(email='member@example.com').scalar()
+        principal = user_cache.load_principal(member_id)
+        login_user(principal)
+        group_id = principal.group_ids[0]
+        fragment = DashboardFragments(group_id).expenses(current_data_version(group_id))
+    assert '/events?cursor=' not in fragment
+
+    page = member_client.get('/dashboard').get_data(as_text=True)
+    assert 'href="/dashboard?cursor=' in page
+    assert '/events?cursor=' not in page
+
+
+def _cached_dashboard(client):
+    # The first view after a POST shows a flash message and is never cached
+    client.get('/dashboard')
+    response = client.get('/dashboard')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    return response
+
+
+def test_repeat_views_are_not_modified_until_a_write(app, member_client):
+    member_client.post('/dashboard', data={'amount_eur': '3.00', 'note': 'bread'})
+    etag = _cached_dashboard(member_client).headers['ETag']
+
+    response = member_client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    # The user comes from the cache; the version check is the only query
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+
+    other = login(app.test_client(), 'other@example.com')
+    other.post('/dashboard', data={'amount_eur': '6.00', 'note': 'cheese'})
+    response = member_client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'cheese' in response.get_data(as_text=True)
+
+
+def test_etags_are_per_viewer(app, admin_client, member_client):
+    member_client.post('/dashboard', data={'amount_eur': '3.00', 'note': 'bread'})
+    etag = _cached_dashboard(member_client).headers['ETag']
+
+    response = admin_client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    # Members only get edit buttons on their own expenses
+    with app.app_context():
+        expense_id = db.session.query(Expense.id).scalar()
+    assert f'/edit-expense/{expense_id}' in response.get_data(as_text=True)
+    other = login(app.test_client(), 'other@example.com')
+    assert f'/edit-expense/{expense_id}' not in other.get('/dashboard').get_data(as_text=True)
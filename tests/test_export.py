@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from app import db, export, services
+from app.models import Expense
+
+
+def _add_expenses(app):
+    with app.app_context():
+        for user_id, amount, day in ((2, '1.00', 1), (3, '2.00', 2), (2, '3.00', 3)):
+            expense = services.add_expense(1, user_id, amount, f'day {day}')
+            expense.date_entered = datetime(2024, 5, day, 12)
+        db.session.commit()
+        services.settle_expense(db.session.get(Expense, 1))
+        db.session.commit()
+
+
+def _ndjson(client, query=''):
+    response = client.get('/export/expenses.ndjson' + query)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_csv_export_streams_every_expense_in_id_order(app, member_client, monkeypatch):
+    _add_expenses(app)
+    # Small batches and chunks, to go through the cursor and buffer flushes
+    app.config['EXPORT_BATCH_SIZE'] = 2
+    monkeypatch.setattr(export, '_CSV_CHUNK_SIZE', 10)
+
+    response = member_client.get('/export/expenses.csv')
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=expenses.csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert tuple(rows[0]) == export.EXPORT_COLUMNS
+    assert rows[1:] == [
+        ['1', '2024-05-01 12:00:00', '1.00', 'day 1', 'settled', '2', 'member@example.com', 'Member'],
+        ['2', '2024-05-02 12:00:00', '2.00', 'day 2', 'unsettled', '3', 'other@example.com', 'Other'],
+        ['3', '2024-05-03 12:00:00', '3.00', 'day 3', 'unsettled', '2', 'member@example.com', 'Member'],
+    ]
+
+
+def test_export_filters(app, member_client):
+    _add_expenses(app)
+    assert [row['id'] for row in _ndjson(member_client)] == [1, 2, 3]
+    assert [row['id'] for row in _ndjson(member_client, '?status=unsettled')] == [2, 3]
+    assert [row['id'] for row in _ndjson(member_client, '?user_id=2')] == [1, 3]
+    assert [row['id'] for row in _ndjson(member_client, '?from=2024-05-02&to=2024-05-02')] == [2]
+    assert _ndjson(member_client, '?user_id=2&status=unsettled')[0]['amount_eur'] == '3.00'
+
+    response = member_client.get('/export/expenses.csv?from=May')
+    assert response.status_code == 400
@@ -0,0 +1,56 @@
+from app import db
+from app.groups import add_member, create_group, remove_member
+from app.models import Expense
+from tests.conftest import add_user, login
+
+
+def _revalidate(client, etag):
+    return client.get('/dashboard', headers={'If-None-Match': etag})
+
+
+def test_membership_changes_refresh_the_dashboard(app, member_client):
+    member_client.post('/dashboard', data={'amount_eur': '9.00', 'note': 'groceries'})
+    # The first view shows the flash message, and is never cached
+    member_client.get('/dashboard')
+    first = member_client.get('/dashboard')
+    assert 'Split between 3 people' in first.get_data(as_text=True)
+    assert _revalidate(member_client, first.headers['ETag']).status_code == 304
+
+    with app.app_context():
+        new_user_id = add_user('fourth@example.com')
+        add_member(1, new_user_id)
+        db.session.commit()
+    response = _revalidate(member_client, first.headers['ETag'])
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'Split between 4 people' in page
+    assert '€2.25' in page
+
+    with app.app_context():
+        assert remove_member(1, new_user_id)
+        db.session.commit()
+    response = _revalidate(member_client, response.headers['ETag'])
+    assert response.status_code == 200
+    assert 'Split between 3 people' in response.get_data(as_text=True)
+
+
+def test_groups_only_see_their_own_expenses(app, admin_client, member_client):
+    with app.app_context():
+        outsider_id = add_user('outsider@example.com')
+        other_group_id = create_group('Elsewhere', [outsider_id]).id
+        db.session.commit()
+    outsider = login(app.test_client(), 'outsider@example.com')
+    outsider.post('/dashboard', data={'amount_eur': '5.00', 'note': 'elsewhere rent'})
+    member_client.post('/dashboard', data={'amount_eur': '7.00', 'note': 'home rent'})
+
+    page = member_client.get('/dashboard').get_data(as_text=True)
+    assert 'home rent' in page and 'elsewhere rent' not in page
+    assert 'home rent' not in outsider.get('/dashboard').get_data(as_text=True)
+
+    with app.app_context():
+        foreign_id = Expense.query.filter_by(group_id=other_group_id).one().id
+    assert admin_client.get(f'/edit-expense/{foreign_id}').status_code == 404
+    assert admin_client.post(f'/settle-expense/{foreign_id}').status_code == 404
+    # Switching to a group you don't belong to is refused
+    admin_client.post(f'/groups/{other_group_id}/select')
+    assert 'elsewhere rent' not in admin_client.get('/admin').get_data(as_text=True)
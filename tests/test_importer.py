@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+from app import db, services
+from app.importer import import_expenses
+from app.ledger import rebuild_ledger
+from app.models import Expense, ExpenseEvent
+
+CSV = 'amount_eur,note,user_email\n1.50,one,member@example.com\n2.25,two,\n'
+
+
+@pytest.mark.parametrize('audit_mode', ('off', 'sync'))
+def test_import_logs_created_expenses_only_when_auditing(app, audit_mode):
+    app.config['AUDIT_LOG_MODE'] = audit_mode
+    with app.app_context():
+        report = import_expenses(io.StringIO(CSV), 1, default_user_id=1)
+        db.session.commit()
+
+        assert report.inserted == 2
+        assert rebuild_ledger(dry_run=True) == []
+        events = ExpenseEvent.query.order_by(ExpenseEvent.id).all()
+        if audit_mode == 'off':
+            assert events == []
+        else:
+            expenses = Expense.query.order_by(Expense.id).all()
+            assert [event.expense_id for event in events] == [expense.id for expense in expenses]
+            assert [event.after['note'] for event in events] == ['one', 'two']
+
+
+def test_audited_import_events_name_the_inserted_expenses(app):
+    with app.app_context():
+        kept = services.add_expense(1, 1, '1.00', 'kept')
+        services.delete_expense(services.add_expense(1, 1, '1.00', 'deleted'))
+        db.session.commit()
+        csv = 'amount_eur,note\n' + ''.join(f'{i}.00,row {i}\n' for i in range(1, 6))
+        import_expenses(io.StringIO(csv), 1, default_user_id=2, batch_size=2)
+        db.session.commit()
+
+        notes = dict(db.session.query(Expense.id, Expense.note).filter(Expense.id != kept.id))
+        events = ExpenseEvent.query.filter_by(action='created').all()
+        assert {event.expense_id: event.after['note'] for event in events
+                if event.after['note'].startswith('row')} == notes
+        assert len(notes) == 5
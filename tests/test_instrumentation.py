@@ -0,0 +1,33 @@
+import re
+
+
+def test_responses_carry_server_timing(app, member_client):
+    response = member_client.get('/dashboard')
+    timing = response.headers['Server-Timing']
+    assert re.fullmatch(r'db;dur=[\d.]+;desc="\d+ queries", render;dur=[\d.]+, '
+                        r'app;dur=[\d.]+, total;dur=[\d.]+', timing)
+    assert not timing.startswith('db;dur=0.0;desc="0 queries"')
+
+    app.config['SERVER_TIMING_HEADER'] = False
+    assert 'Server-Timing' not in member_client.get('/dashboard').headers
+
+
+def test_metrics_are_for_admins(app, admin_client, member_client):
+    member_client.get('/dashboard')
+    response = admin_client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert '# TYPE app_request_duration_seconds histogram' in body
+    assert 'endpoint="main.dashboard"' in body
+
+    assert member_client.get('/metrics').status_code == 404
+    # The test client's requests come from 127.0.0.1
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_local_scrapers_need_metrics_allow_local(app):
+    app.config['METRICS_ALLOW_LOCAL'] = True
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    remote = client.get('/metrics', environ_base={'REMOTE_ADDR': '192.0.2.1'})
+    assert remote.status_code == 404
@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+from app import db, services
+from app.ledger import rebuild_ledger
+from app.models import UserBalance
+
+MEMBER_ID = 2
+
+
+def _ledger(user_id=MEMBER_ID):
+    row = db.session.get(UserBalance, (1, user_id))
+    db.session.refresh(row)
+    return row.total_paid, row.expense_count, row.unsettled_total
+
+
+def test_mutations_update_the_ledger_in_their_transaction(app):
+    with app.app_context():
+        assert _ledger() == (Decimal('0.00'), 0, Decimal('0.00'))
+
+        first = services.add_expense(1, MEMBER_ID, '10.00', 'rent')
+        second = services.add_expense(1, MEMBER_ID, '2.50', 'milk')
+        db.session.commit()
+        assert _ledger() == (Decimal('12.50'), 2, Decimal('12.50'))
+
+        services.update_expense(first, '12.00', 'rent')
+        db.session.commit()
+        assert _ledger() == (Decimal('14.50'), 2, Decimal('14.50'))
+
+        services.settle_expense(first)
+        db.session.commit()
+        assert _ledger() == (Decimal('14.50'), 2, Decimal('2.50'))
+
+        # Editing a settled expense changes what was paid, not what is open
+        services.update_expense(first, '11.00', 'rent')
+        db.session.commit()
+        assert _ledger() == (Decimal('13.50'), 2, Decimal('2.50'))
+
+        services.delete_expense(second)
+        db.session.commit()
+        assert _ledger() == (Decimal('11.00'), 1, Decimal('0.00'))
+
+        # A rolled back change leaves the ledger alone
+        services.add_expense(1, MEMBER_ID, '99.00', 'mistake')
+        db.session.rollback()
+        assert _ledger() == (Decimal('11.00'), 1, Decimal('0.00'))
+        assert rebuild_ledger(dry_run=True) == []
+
+
+def test_settling_many_expenses_updates_each_payer(app):
+    with app.app_context():
+        ids = [services.add_expense(1, user_id, amount, 'shared').id
+               for user_id, amount in ((1, '3.00'), (2, '4.00'), (2, '5.00'))]
+        db.session.commit()
+        assert services.settle_expense_ids(1, ids[1:]) == (2, Decimal('9.00'))
+        db.session.commit()
+        assert _ledger(1) == (Decimal('3.00'), 1, Decimal('3.00'))
+        assert _ledger(2) == (Decimal('9.00'), 2, Decimal('0.00'))
+        assert rebuild_ledger(dry_run=True) == []
+
+
+def test_reconcile_ledger_reports_and_corrects_drift(app):
+    with app.app_context():
+        services.add_expense(1, MEMBER_ID, '10.00', 'rent')
+        db.session.commit()
+        db.session.get(UserBalance, (1, MEMBER_ID)).total_paid = Decimal('7.00')
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['reconcile-ledger', '--dry-run'])
+    assert result.exit_code == 1
+    assert 'group 1 user 2 total_paid: stored 7.00, expected 10.00' in result.output
+    assert '1 ledger value(s) found' in result.output
+
+    result = runner.invoke(args=['reconcile-ledger'])
+    assert result.exit_code == 0
+    assert '1 ledger value(s) corrected' in result.output
+    with app.app_context():
+        assert _ledger() == (Decimal('10.00'), 1, Decimal('10.00'))
+
+    result = runner.invoke(args=['reconcile-ledger', '--dry-run'])
+    assert result.exit_code == 0
+    assert 'Ledger matches the expense table' in result.output
+
+
+def test_changes_to_an_edited_expense_in_the_same_transaction(app):
+    with app.app_context():
+        expense = services.add_expense(1, MEMBER_ID, '10.00', 'rent')
+        services.update_expense(expense, '12.00', 'rent')
+        services.settle_expense(expense)
+        db.session.commit()
+        assert _ledger() == (Decimal('12.00'), 1, Decimal('0.00'))
+        assert rebuild_ledger(dry_run=True) == []
@@ -0,0 +1,82 @@
+import json
+import threading
+
+from app import db
+from app.fragments import current_data_version
+from app.groups import create_group
+from tests.conftest import add_user, login
+
+
+def _open_stream(client, since):
+    response = client.get(f'/events?since={since}', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    return iter(response.response)
+
+
+def _read(events):
+    """The next message as ``(id, event, data)``"""
+    fields = dict(line.split(': ', 1) for line in next(events).decode().strip().split('\n'))
+    return int(fields['id']), fields.get('event'), json.loads(fields.get('data', 'null'))
+
+
+def _post(client, url, **kwargs):
+    """POST from another thread, as another worker thread would.
+
+    The open stream keeps its request context pushed on this thread, and a
+    request made here would share its ``g`` (and logged-in user).
+    """
+    thread = threading.Thread(target=client.post, args=(url,), kwargs=kwargs)
+    thread.start()
+    thread.join()
+
+
+def _version(app):
+    with app.app_context():
+        return current_data_version(1)
+
+
+def test_events_send_deltas_for_each_write(app, member_client):
+    other = login(app.test_client(), 'other@example.com')
+    version = _version(app)
+    events = _open_stream(member_client, version)
+    assert next(events).decode() == f'retry: 2000\nid: {version}\n\n'
+
+    _post(other, '/dashboard', data={'amount_eur': '6.00', 'note': 'cheese'})
+    expense_id, version = 1, _version(app)
+    message_id, name, data = _read(events)
+    assert (message_id, name) == (version, 'expense')
+    assert data['id'] == expense_id and data['added']
+    assert 'cheese' in data['html'] and f'/edit-expense/{expense_id}' not in data['html']
+    message_id, name, data = _read(events)
+    assert name == 'balances' and '€6.00' in data['summary_html']
+
+    _post(other, f'/delete-expense/{expense_id}')
+    assert _read(events) == (_version(app), 'expense-removed', {'id': expense_id})
+    assert _read(events)[1] == 'balances'
+
+
+def test_events_refresh_a_stale_page(app, member_client):
+    member_client.post('/dashboard', data={'amount_eur': '6.00', 'note': 'cheese'})
+    events = _open_stream(member_client, 0)
+    next(events)
+    message_id, name, data = _read(events)
+    assert (message_id, name) == (_version(app), 'refresh')
+    assert 'cheese' in data['expenses_html']
+
+
+def test_events_refresh_after_settle_all_and_ignore_other_groups(app, admin_client,
+                                                                 member_client):
+    with app.app_context():
+        outsider_id = add_user('outsider@example.com')
+        create_group('Elsewhere', [outsider_id])
+        db.session.commit()
+    outsider = login(app.test_client(), 'outsider@example.com')
+    _post(member_client, '/dashboard', data={'amount_eur': '6.00', 'note': 'cheese'})
+    events = _open_stream(member_client, _version(app))
+    next(events)
+
+    _post(outsider, '/dashboard', data={'amount_eur': '1.00', 'note': 'elsewhere'})
+    _post(admin_client, '/settle-expenses')
+    message_id, name, data = _read(events)
+    assert (message_id, name) == (_version(app), 'refresh')
+    assert 'elsewhere' not in data['expenses_html']
@@ -0,0 +1,56 @@
+import threading
+
+from werkzeug.security import generate_password_hash
+
+from app import db, passwords
+from app.models import User
+from tests.conftest import PASSWORD
+
+
+def _stored_hash(app):
+    with app.app_context():
+        return User.query.filter_by(email='member@example.com').one().password_hash
+
+
+def test_login_upgrades_outdated_hashes(app):
+    with app.app_context():
+        user = User.query.filter_by(email='member@example.com').one()
+        user.password_hash = generate_password_hash(PASSWORD, 'pbkdf2:sha256:2000')
+        db.session.commit()
+    client = app.test_client()
+
+    client.post('/login', data={'email': 'member@example.com', 'password': 'wrong'})
+    assert _stored_hash(app).startswith('pbkdf2:sha256:2000$')
+
+    response = client.post('/login', data={'email': 'member@example.com', 'password': PASSWORD})
+    assert response.status_code == 302
+    assert _stored_hash(app).startswith('pbkdf2:sha256:1000$')
+    with app.app_context():
+        assert User.query.filter_by(email='member@example.com').one().check_password(PASSWORD)
+
+
+def test_needs_rehash_compares_werkzeug_defaults(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+    with app.app_context():
+        assert not passwords.needs_rehash('scrypt:32768:8:1$salt$hash')
+        assert passwords.needs_rehash('scrypt:16384:8:1$salt$hash')
+        assert passwords.needs_rehash('pbkdf2:sha256:1000$salt$hash')
+
+
+def test_login_is_refused_while_the_hasher_is_busy(make_app, app):
+    busy_app = make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_TIMEOUT=0.05)
+    release = threading.Event()
+    with busy_app.app_context():
+        # Occupy the only hashing thread
+        passwords._pool().submit(release.wait)
+    try:
+        response = busy_app.test_client().post('/login', data={
+            'email': 'member@example.com', 'password': PASSWORD
+        })
+        assert response.status_code == 503
+        assert 'Too many people are signing in' in response.get_data(as_text=True)
+    finally:
+        release.set()
+        busy_app.extensions['password_hasher'].shutdown()
+    with busy_app.app_context():
+        db.engine.dispose()
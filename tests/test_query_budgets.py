@@ -0,0 +1,74 @@
+import pytest
+
+from app import db
+from app.api import create_token
+from app.instrumentation import QueryBudgetExceeded, query_budget
+from app.models import User
+
+MEMBER_ROUTES = (
+    '/dashboard',
+    '/expenses/rows',
+    '/search?q=pool',
+    '/search?q=pool&status=unsettled',
+    '/search.json?q=pool',
+    '/reports',
+    '/reports.json?status=unsettled',
+    '/settlements',
+)
+API_ROUTES = (
+    '/api/v1/expenses',
+    '/api/v1/expenses?status=unsettled&limit=2',
+    '/api/v1/balances',
+)
+
+
+@pytest.fixture
+def history(app, admin_client, member_client):
+    """Enough expenses for several pages, and one closed settlement period"""
+    app.config['EXPENSES_PER_PAGE'] = 2
+    for client in (admin_client, member_client):
+        for amount in ('3.00', '4.50', '6.25'):
+            client.post('/dashboard', data={'amount_eur': amount, 'note': 'pool cleaning'})
+    admin_client.post('/settle-expenses')
+    member_client.post('/dashboard', data={'amount_eur': '2.00', 'note': 'pool chlorine'})
+
+
+@pytest.mark.parametrize('path', MEMBER_ROUTES)
+def test_member_routes_stay_within_budget(history, member_client, path):
+    # The first request fills the caches, the second reads them
+    for _ in range(2):
+        assert member_client.get(path).status_code == 200
+
+
+@pytest.mark.parametrize('path', ('/admin', '/expenses/rows?view=admin', '/settlements/1'))
+def test_admin_routes_stay_within_budget(history, admin_client, path):
+    for _ in range(2):
+        assert admin_client.get(path).status_code == 200
+
+
+def test_edit_form_stays_within_budget(history, member_client):
+    assert member_client.get('/edit-expense/7').status_code == 200
+
+
+@pytest.mark.parametrize('path', API_ROUTES)
+def test_api_routes_stay_within_budget(app, history, path):
+    with app.app_context():
+        member_id = db.session.query(User.id).filter_by(email='member@example.com').scalar()
+        _, token = create_token(member_id, 1, 'tests')
+        db.session.commit()
+    client = app.test_client()
+    for _ in range(2):
+        response = client.get(path, headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+
+
+def test_exceeding_a_budget_fails_the_request(app):
+    @app.route('/over-budget')
+    @query_budget(1)
+    def over_budget():
+        db.session.query(User.id).all()
+        db.session.query(User.email).all()
+        return 'done'
+
+    with pytest.raises(QueryBudgetExceeded, match='over its budget of 1'):
+        app.test_client().get('/over-budget')
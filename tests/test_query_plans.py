@@ -0,0 +1,36 @@
+"""The hot routes' statements must not scan ``expense`` sequentially.
+
+Runs :mod:`benchmarks.plans` on a small temporary SQLite database, or on
+``PLANS_DATABASE_URL`` (all its tables are dropped) to check PostgreSQL's
+plans; that case is skipped when the database can't be reached.
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from benchmarks import plans
+
+
+def _database_url(tmp_path):
+    url = os.environ.get('PLANS_DATABASE_URL')
+    if not url:
+        return 'sqlite:///' + str(tmp_path / 'plans.db')
+    try:
+        engine = create_engine(url)
+        with engine.connect():
+            pass
+        engine.dispose()
+    except (ImportError, SQLAlchemyError) as e:
+        pytest.skip(f'PLANS_DATABASE_URL is not available: {e}')
+    return url
+
+
+def test_hot_routes_do_not_scan_expense(tmp_path, capsys):
+    # Enough expenses that expense counts as large, the rest stay small
+    failures = plans.run(_database_url(tmp_path), expenses=3000, users=4, max_scan_rows=1000)
+    output = capsys.readouterr().out
+    assert failures == 0, output
+    for name in ('expense_rows', 'search_filtered', 'api_expenses', 'settle_expenses'):
+        assert f'{name}: 0 statement(s)' not in output
@@ -0,0 +1,10 @@
+def test_reports_link_keeps_only_known_filters(member_client):
+    member_client.post('/dashboard', data={'amount_eur': '1.00', 'note': 'one'})
+
+    for query in ('fmt=x', 'endpoint=x', 'status=unsettled&fmt=x'):
+        response = member_client.get(f'/reports?{query}')
+        assert response.status_code == 200, query
+        assert 'fmt=x' not in response.get_data(as_text=True)
+
+    page = member_client.get('/reports?status=unsettled').get_data(as_text=True)
+    assert '/reports.json?status=unsettled' in page
@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+from sqlalchemy import inspect, text
+
+from app import db
+from app.balances import compute_balances
+from app.groups import DEFAULT_GROUP_NAME
+from app.ledger import rebuild_ledger
+from app.models import Expense, Group, User
+from app.rollups import rebuild_rollups
+from app.schema import upgrade_schema
+
+# The two tables of the original release, as its models created them
+BASELINE_SCHEMA = (
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, email VARCHAR(120) NOT NULL UNIQUE, '
+    'password_hash VARCHAR(200) NOT NULL, full_name VARCHAR(100) NOT NULL, '
+    'is_admin BOOLEAN, force_password_change BOOLEAN)',
+    'CREATE INDEX ix_user_email ON user (email)',
+    'CREATE TABLE expense (id INTEGER PRIMARY KEY, date_entered DATETIME, '
+    'amount_eur NUMERIC(10, 2) NOT NULL, note TEXT NOT NULL, '
+    'user_id INTEGER NOT NULL REFERENCES user (id), status VARCHAR(20))',
+    'CREATE INDEX ix_expense_date_entered ON expense (date_entered)',
+)
+
+
+def _deploy():
+    """What ``init_db.py`` does on every deploy"""
+    db.create_all()
+    upgrade_schema()
+    rebuild_ledger()
+    rebuild_rollups()
+    db.session.commit()
+
+
+def test_upgrade_from_baseline_schema(make_app):
+    app = make_app()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.execute(text(statement))
+            connection.execute(text(
+                "INSERT INTO user VALUES (1, 'a@example.com', 'x', 'A', 1, 0), "
+                "(2, 'b@example.com', 'x', 'B', 0, 0)"
+            ))
+            connection.execute(text(
+                "INSERT INTO expense VALUES "
+                "(1, '2024-01-05 10:00:00', 10.00, 'one', 1, 'unsettled'), "
+                "(2, '2024-02-05 10:00:00', 4.50, 'two', 2, 'unsettled'), "
+                "(3, '2023-12-05 10:00:00', 7.00, 'old', 2, 'settled')"
+            ))
+
+        _deploy()
+        # Every deploy runs it again
+        _deploy()
+
+        group = Group.query.one()
+        assert group.name == DEFAULT_GROUP_NAME
+        assert sorted(user.id for user in group.members) == [1, 2]
+        assert {expense.group_id for expense in Expense.query} == {group.id}
+        assert rebuild_ledger(dry_run=True) == []
+
+        summary = compute_balances(group.id)
+        assert summary.total_expenses == Decimal('21.50')
+        assert summary.member_count == 2
+
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('expense')}
+        assert 'ix_expense_date_entered' not in indexes
+        assert 'ix_expense_group_listing' in indexes
+        assert User.query.count() == 2
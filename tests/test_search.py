@@ -0,0 +1,11 @@
+def test_search_links_keep_only_known_filters(app, member_client):
+    app.config['EXPENSES_PER_PAGE'] = 1
+    for note in ('pool one', 'pool two'):
+        member_client.post('/dashboard', data={'amount_eur': '1.00', 'note': note})
+
+    response = member_client.get('/search?q=pool&status=unsettled&endpoint=x&fmt=y&page=1')
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'page=2' in page
+    assert 'endpoint=' not in page and 'fmt=' not in page
+    assert 'status=unsettled' in page
@@ -0,0 +1,28 @@
+import json
+
+from app import db
+from app.api import create_token
+from app.audit import snapshot
+from app.models import Expense, ExpenseEvent
+
+
+def test_api_search_export_and_audit_serialize_expenses_alike(app, member_client):
+    member_client.post('/dashboard', data={'amount_eur': '12.5', 'note': 'pool filter'})
+    with app.app_context():
+        expense = Expense.query.one()
+        _, token = create_token(expense.user_id, expense.group_id, 'tests')
+        db.session.commit()
+        expected = expense.to_dict()
+        event = ExpenseEvent.query.one()
+        assert event.after == snapshot(expense)
+
+    assert expected['amount_eur'] == '12.50'
+    api = json.loads(member_client.get(f'/api/v1/expenses/{expected["id"]}',
+                                       headers={'Authorization': f'Bearer {token}'}).data)
+    search = json.loads(member_client.get('/search.json?q=pool').data)['results'][0]
+    export = json.loads(member_client.get('/export/expenses.ndjson').data)
+    assert api == expected
+    assert search == expected
+    assert export == {**{name: expected[name] for name in export if name != 'user_email'},
+                      'user_email': 'member@example.com'}
+    assert event.after == {name: expected[name] for name in event.after}
@@ -0,0 +1,135 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from app import db, services
+from app.balances import MemberBalance, Transfer, compute_balances, settle_up
+from app.groups import add_member
+from app.models import Expense, Settlement, SettlementBatch
+from tests.conftest import add_user
+from app.settlement import run_batch, start_settle_all
+
+
+def _add_expenses(app, count):
+    with app.app_context():
+        for i in range(count):
+            services.add_expense(1, 2, '1.00', f'expense {i}')
+        db.session.commit()
+
+
+def _unsettled():
+    return Expense.query.filter_by(status='unsettled').count()
+
+
+def test_settle_all_commits_in_chunks_and_reports_progress(app, admin_client, monkeypatch):
+    app.config['SETTLE_CHUNK_SIZE'] = 2
+    _add_expenses(app, 5)
+    chunks = []
+    settle_expense_ids = services.settle_expense_ids
+
+    def record_chunk(group_id, expense_ids):
+        chunks.append(len(expense_ids))
+        return settle_expense_ids(group_id, expense_ids)
+    monkeypatch.setattr(services, 'settle_expense_ids', record_chunk)
+
+    response = admin_client.post('/settle-expenses', follow_redirects=True)
+    assert '5 expense(s) have been settled!' in response.get_data(as_text=True)
+    assert chunks == [2, 2, 1]
+    with app.app_context():
+        assert _unsettled() == 0
+        batch_id = SettlementBatch.query.one().id
+
+    status = admin_client.get(f'/settle-expenses/{batch_id}').get_json()
+    assert status == {'id': batch_id, 'status': 'done', 'total_count': 5, 'settled_count': 5,
+                      'total_amount': '5.00', 'settled_amount': '5.00', 'percent': 100,
+                      'error': None}
+
+
+def test_batches_only_settle_expenses_that_existed_when_they_started(app):
+    _add_expenses(app, 3)
+    with app.app_context():
+        batch = SettlementBatch(group_id=1, started_by_id=1, max_expense_id=2,
+                                total_count=2, total_amount=Decimal('2.00'))
+        db.session.add(batch)
+        db.session.commit()
+        batch = run_batch(batch.id)
+        assert (batch.status, batch.settled_count) == ('done', 2)
+        assert [expense.id for expense in Expense.query.filter_by(status='unsettled')] == [3]
+
+
+def test_a_running_batch_blocks_a_second_one_until_it_goes_stale(app, admin_client):
+    _add_expenses(app, 2)
+    with app.app_context():
+        running = SettlementBatch(group_id=1, started_by_id=1, status='running',
+                                  max_expense_id=2, total_count=2)
+        db.session.add(running)
+        db.session.commit()
+        running_id = running.id
+
+    response = admin_client.post('/settle-expenses', follow_redirects=True)
+    assert 'A settlement is already in progress.' in response.get_data(as_text=True)
+    with app.app_context():
+        assert _unsettled() == 2
+
+        # Its worker died: no progress for longer than SETTLE_STALE_SECONDS
+        stale = datetime.utcnow() - timedelta(seconds=app.config['SETTLE_STALE_SECONDS'] + 1)
+        db.session.get(SettlementBatch, running_id).updated_at = stale
+        db.session.commit()
+        batch, started = start_settle_all(1, 1)
+        assert started and batch.status == 'done' and batch.settled_count == 2
+
+        abandoned = db.session.get(SettlementBatch, running_id)
+        assert abandoned.status == 'failed'
+        assert abandoned.error.startswith('Abandoned')
+        assert _unsettled() == 0
+
+
+def test_settling_closes_the_period_with_a_snapshot_and_transfers(app, admin_client):
+    with app.app_context():
+        add_member(1, add_user('fourth@example.com'))
+        services.add_expense(1, 1, '40.00', 'roof')
+        services.add_expense(1, 2, '20.00', 'garden')
+        db.session.commit()
+    admin_client.post('/settle-expenses')
+
+    with app.app_context():
+        settlement = Settlement.query.one()
+        assert (settlement.total_expenses, settlement.member_count,
+                settlement.cost_per_person) == (Decimal('60.00'), 4, Decimal('15.00'))
+        shares = {share.user_id: (share.paid, share.share, share.net)
+                  for share in settlement.shares}
+        assert shares == {1: (Decimal('40.00'), Decimal('15.00'), Decimal('25.00')),
+                          2: (Decimal('20.00'), Decimal('15.00'), Decimal('5.00')),
+                          3: (Decimal('0.00'), Decimal('15.00'), Decimal('-15.00')),
+                          4: (Decimal('0.00'), Decimal('15.00'), Decimal('-15.00'))}
+
+        # At most one transfer fewer than members, and they settle every balance
+        transfers = settlement.transfers.all()
+        assert len(transfers) <= settlement.member_count - 1
+        net = defaultdict(Decimal)
+        for transfer in transfers:
+            net[transfer.from_user_id] += transfer.amount
+            net[transfer.to_user_id] -= transfer.amount
+        assert {user_id: -amount for user_id, amount in net.items()} == \
+            {user_id: share[2] for user_id, share in shares.items()}
+
+        # The new period starts from zero
+        assert compute_balances(1).total_expenses == Decimal('0.00')
+        services.add_expense(1, 3, '8.00', 'bulbs')
+        db.session.commit()
+        summary = compute_balances(1)
+        assert (summary.total_expenses, summary.cost_per_person) == (Decimal('8.00'),
+                                                                     Decimal('2.00'))
+        assert summary.period_start == settlement.closed_at
+        settlement_id = settlement.id
+
+    page = admin_client.get(f'/settlements/{settlement_id}').get_data(as_text=True)
+    assert '€60.00' in page and '+€25.00' in page and '-€15.00' in page
+    assert page.count(' pays') == len(transfers)
+
+
+def test_settle_up_needs_no_transfer_for_settled_members():
+    members = [MemberBalance(1, 'A', Decimal('10.00'), 1, Decimal('5.00')),
+               MemberBalance(2, 'B', Decimal('5.00'), 1, Decimal('0.00')),
+               MemberBalance(3, 'C', Decimal('0.00'), 0, Decimal('-5.00'))]
+    assert settle_up(members) == [Transfer(3, 'C', 1, 'A', Decimal('5.00'))]
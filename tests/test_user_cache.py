@@ -0,0 +1,33 @@
+import os
+import stat
+
+import pytest
+
+from app.user_cache import FilesystemBackend, _create_backend
+
+
+def test_filesystem_cache_defaults_to_a_private_instance_directory(make_app, tmp_path):
+    app = make_app()
+    app.instance_path = str(tmp_path / 'instance')
+    app.config['USER_CACHE_BACKEND'] = 'filesystem'
+    backend = _create_backend(app)
+    assert backend.directory == os.path.join(app.instance_path, 'user-cache')
+    assert stat.S_IMODE(os.stat(backend.directory).st_mode) == 0o700
+
+
+def test_filesystem_cache_tightens_a_directory_others_can_write(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    FilesystemBackend(str(directory), ttl=60)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() != 0,
+                    reason='needs root to hand the directory to another user')
+def test_filesystem_cache_refuses_a_directory_of_another_user(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    os.chown(directory, 12345, 12345)
+    with pytest.raises(RuntimeError, match='belongs to another user'):
+        FilesystemBackend(str(directory), ttl=60)